@@ -0,0 +1,150 @@
+"""Recorded transport.rest payloads for the offline benchmarks
+
+Fixtures are kept in bench/fixtures/vbb.json. They can be recorded from
+the live API (needs network access) or synthesised with the same shape:
+
+    python -m bench.fixtures record --lat 52.5219 --lon 13.4132
+    python -m bench.fixtures synthesize
+"""
+import argparse
+import json
+import math
+import os
+import random
+from datetime import datetime, timedelta, timezone
+
+FIXTURE_FILE = os.path.join(os.path.dirname(__file__), 'fixtures', 'vbb.json')
+
+# Alexanderplatz
+CENTER = (52.5219, 13.4132)
+
+LINES = [
+    ('U2', 'subway', 'U'), ('U5', 'subway', 'U'), ('U8', 'subway', 'U'),
+    ('S5', 'suburban', 'S'), ('S7', 'suburban', 'S'), ('S75', 'suburban', 'S'),
+    ('M2', 'tram', 'STR'), ('M4', 'tram', 'STR'), ('M5', 'tram', 'STR'),
+    ('100', 'bus', 'Bus'), ('200', 'bus', 'Bus'), ('248', 'bus', 'Bus'), ('TXL', 'bus', 'Bus'),
+    ('RE1', 'regional', 'RE'), ('RB23', 'regional', 'RB')
+]
+DIRECTIONS = ['Pankow', 'Ruhleben', 'Hermannstr.', 'Spandau', 'Potsdam Hbf', 'Ahrensfelde',
+              'Hackescher Markt', 'Zoologischer Garten', 'Flughafen BER', 'Frankfurt (Oder)']
+
+def synthesize(stations=50, departures=30, seed=1):
+    """Generate fixtures shaped like transport.rest v6 responses"""
+    rng = random.Random(seed)
+    recorded_at = datetime.now(timezone.utc).replace(microsecond=0)
+    nearby = []
+    station_departures = {}
+
+    for i in range(stations):
+        # Spread stations within ~550 m so all of them are in walking range
+        distance = 50 + 500 * math.sqrt(rng.random())
+        bearing = rng.uniform(0, 2 * math.pi)
+        lat = CENTER[0] + distance * math.cos(bearing) / 111320
+        lon = CENTER[1] + distance * math.sin(bearing) / (111320 * math.cos(math.radians(CENTER[0])))
+        station_id = str(900100001 + i)
+        station = {
+            'type': 'stop',
+            'id': station_id,
+            'name': f"Teststr. {i + 1} (Berlin)",
+            'location': {'type': 'location', 'id': station_id, 'latitude': round(lat, 6), 'longitude': round(lon, 6)},
+            'products': {'suburban': True, 'subway': True, 'tram': True, 'bus': True},
+            'distance': int(distance)
+        }
+        nearby.append(station)
+
+        lines = rng.sample(LINES, rng.randint(2, 5))
+        deps = []
+        for k in range(departures):
+            name, product, product_name = rng.choice(lines)
+            planned = recorded_at + timedelta(seconds=rng.randint(-60, 60 * 60))
+            delay = rng.choice([None, 0, 0, 0, 60, 120, 240])
+            when = planned + timedelta(seconds=delay or 0)
+            platform = rng.choice([None, '1', '2', '3'])
+            deps.append({
+                'tripId': f"1|{rng.randint(10000, 99999)}|{k}|86|{recorded_at:%d%m%Y}",
+                'stop': {'type': 'stop', 'id': station_id, 'name': station['name']},
+                'when': when.isoformat(),
+                'plannedWhen': planned.isoformat(),
+                'delay': delay,
+                'platform': platform,
+                'plannedPlatform': platform,
+                'direction': rng.choice(DIRECTIONS),
+                'line': {
+                    'type': 'line',
+                    'id': name.lower(),
+                    'name': name,
+                    'mode': 'bus' if product == 'bus' else 'train',
+                    'product': product,
+                    'productName': product_name
+                },
+                'remarks': []
+            })
+        deps.sort(key=lambda dep: dep['when'])
+        station_departures[station_id] = {'departures': deps}
+
+    return {
+        'recorded_at': recorded_at.isoformat(),
+        'center': list(CENTER),
+        'nearby': nearby,
+        'departures': station_departures
+    }
+
+def record(lat, lon, stations=50, departures=30, timeout=10):
+    """Record fixtures from the live transport.rest API"""
+    import requests
+
+    base = 'https://v6.vbb.transport.rest'
+    recorded_at = datetime.now(timezone.utc).replace(microsecond=0)
+    nearby = requests.get(f"{base}/locations/nearby", params={
+        'latitude': lat, 'longitude': lon, 'distance': 2000, 'results': stations
+    }, timeout=timeout).json()
+
+    station_departures = {}
+    for station in nearby:
+        response = requests.get(f"{base}/stops/{station['id']}/departures",
+                                params={'results': departures, 'duration': 120}, timeout=timeout)
+        if response.status_code == 200:
+            station_departures[station['id']] = response.json()
+
+    return {
+        'recorded_at': recorded_at.isoformat(),
+        'center': [lat, lon],
+        'nearby': nearby,
+        'departures': station_departures
+    }
+
+def save(fixtures, path=FIXTURE_FILE):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(fixtures, f)
+
+def load(path=FIXTURE_FILE):
+    """Load fixtures, synthesising them on first use"""
+    if not os.path.exists(path):
+        save(synthesize(), path)
+    with open(path, 'r') as f:
+        return json.load(f)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+    synth = commands.add_parser('synthesize', help='generate synthetic fixtures')
+    synth.add_argument('--stations', type=int, default=50)
+    synth.add_argument('--departures', type=int, default=30)
+    synth.add_argument('--seed', type=int, default=1)
+    rec = commands.add_parser('record', help='record fixtures from the live API')
+    rec.add_argument('--lat', type=float, default=CENTER[0])
+    rec.add_argument('--lon', type=float, default=CENTER[1])
+    rec.add_argument('--stations', type=int, default=50)
+    rec.add_argument('--departures', type=int, default=30)
+    args = parser.parse_args()
+
+    if args.command == 'record':
+        fixtures = record(args.lat, args.lon, args.stations, args.departures)
+    else:
+        fixtures = synthesize(args.stations, args.departures, args.seed)
+    save(fixtures)
+    print(f"Saved {len(fixtures['nearby'])} stations to {FIXTURE_FILE}")
+
+if __name__ == '__main__':
+    main()
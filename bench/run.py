@@ -0,0 +1,182 @@
+"""Offline benchmarks for the departure board
+
+Starts the stub server for each scenario, points the app at it and
+reports latency percentiles and throughput:
+
+    python -m bench.run
+    python -m bench.run --scenarios 5,20 --requests 500 --concurrency 4 --latency 30 --error-rate 0.02
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from bench import fixtures as fixture_store
+from bench.stub_server import Replay
+from delay_log import percentile as sorted_percentile
+
+def start_stub(stations, latency, jitter, error_rate):
+    """Run the stub server in its own process so it does not share our GIL"""
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'bench.stub_server', '--stations', str(stations),
+         '--latency', str(latency), '--jitter', str(jitter), '--error-rate', str(error_rate)],
+        cwd=REPO_ROOT, stdout=subprocess.PIPE, text=True
+    )
+    port = int(process.stdout.readline())
+    return process, f"http://127.0.0.1:{port}"
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    if not ordered:
+        return 0.0
+    return sorted_percentile(ordered, pct)
+
+def measure(call, requests, concurrency=1):
+    """Run call() `requests` times and summarise latencies
+
+    call() returns True on success. With concurrency > 1 every worker
+    thread gets its own call from the factory passed as `call`.
+    """
+    def worker(count):
+        run = call()
+        timings, errors = [], 0
+        for _ in range(count):
+            start = time.perf_counter()
+            try:
+                ok = run()
+            except Exception:
+                ok = False
+            timings.append(time.perf_counter() - start)
+            errors += 0 if ok else 1
+        return timings, errors
+
+    shares = [requests // concurrency + (1 if i < requests % concurrency else 0) for i in range(concurrency)]
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(worker, shares))
+    elapsed = time.perf_counter() - started
+
+    timings = [t for worker_timings, _ in results for t in worker_timings]
+    return {
+        'requests': len(timings),
+        'errors': sum(errors for _, errors in results),
+        'p50_ms': percentile(timings, 50) * 1000,
+        'p95_ms': percentile(timings, 95) * 1000,
+        'p99_ms': percentile(timings, 99) * 1000,
+        'rps': len(timings) / elapsed if elapsed else 0.0
+    }
+
+def http_call(app_module, path, before=None):
+    def factory():
+        client = app_module.app.test_client()
+
+        def run():
+            if before:
+                before()
+            return client.get(path).status_code < 500
+        return run
+    return factory
+
+def processing_call(fixtures, stations, incremental=False):
+    """Turn the departures of every station into board rows
+
+    By default every run starts from scratch; with `incremental` the
+    departures are merged into the station states of the previous run,
+    as the poller does between two unchanged fetches.
+    """
+    from departure_pipeline import StationState, process_board
+
+    replay = Replay(fixtures, stations)
+    payloads = [(station, 5, replay.station_departures(station['id'], 30)['departures'])
+                for station in replay.nearby]
+
+    def factory():
+        states = {station['id']: StationState() for station, _, _ in payloads}
+
+        def run():
+            board = []
+            for station, walk_time, deps in payloads:
+                state = states[station['id']] if incremental else StationState()
+                state.merge(deps)
+                board.append((station, walk_time, state, None))
+            process_board(board, 2, 30)
+            return True
+        return run
+    return factory
+
+def run_scenario(app_module, fixtures, stations, args):
+    process, url = start_stub(stations, args.latency, args.jitter, args.error_rate)
+    try:
+        lat, lon = fixtures['center']
+        app_module.VBB_API_URL = url
+        app_module.settings.update({
+            'latitude': lat,
+            'longitude': lon,
+            'max_walk_minutes': 10,
+            'selected_stations': [],
+            'poll_interval': 3600
+        })
+        app_module.invalidate_station_cache()
+        app_module.poller.invalidate()
+        # Warm the station cache and the board snapshot
+        app_module.app.test_client().get('/')
+
+        def cold():
+            # Drop the snapshot and make every station due again
+            app_module.scheduler.forget(())
+            app_module.poller.invalidate()
+
+        results = {
+            'GET / (cold)': measure(http_call(app_module, '/', cold), args.cold_requests),
+            'GET /': measure(http_call(app_module, '/'), args.requests, args.concurrency),
+            'GET /api/nearby_stations': measure(http_call(app_module, '/api/nearby_stations'),
+                                                args.requests, args.concurrency),
+            'processing': measure(processing_call(fixtures, stations), args.requests),
+            'processing (incremental)': measure(processing_call(fixtures, stations, incremental=True),
+                                                args.requests)
+        }
+    finally:
+        process.terminate()
+        process.wait()
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenarios', default='5,20,50', help='comma separated station counts')
+    parser.add_argument('--requests', type=int, default=200, help='requests per warm target')
+    parser.add_argument('--cold-requests', type=int, default=20, help='requests for the cold board')
+    parser.add_argument('--concurrency', type=int, default=1)
+    parser.add_argument('--latency', type=float, default=20, help='stub latency per request (ms)')
+    parser.add_argument('--jitter', type=float, default=10, help='random extra stub latency (ms)')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of stub requests failing')
+    parser.add_argument('--json', help='also write the results to this file')
+    args = parser.parse_args()
+
+    fixtures = fixture_store.load()
+
+    # Settings and caches of the app are written to a scratch directory
+    os.chdir(tempfile.mkdtemp(prefix='departure-board-bench-'))
+    import nearby_departures
+
+    report = {}
+    print(f"{'stations':>8}  {'target':<26}{'n':>6}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'req/s':>10}{'errors':>8}")
+    for stations in [int(count) for count in args.scenarios.split(',')]:
+        results = run_scenario(nearby_departures, fixtures, stations, args)
+        report[stations] = results
+        for target, stats in results.items():
+            print(f"{stations:>8}  {target:<26}{stats['requests']:>6}{stats['p50_ms']:>10.2f}"
+                  f"{stats['p95_ms']:>10.2f}{stats['p99_ms']:>10.2f}{stats['rps']:>10.1f}{stats['errors']:>8}")
+
+    if args.json:
+        with open(os.path.join(REPO_ROOT, args.json) if not os.path.isabs(args.json) else args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == '__main__':
+    main()
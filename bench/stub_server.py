@@ -0,0 +1,130 @@
+"""Local stand-in for transport.rest and Nominatim replaying recorded fixtures
+
+Departure times are shifted so the recording looks as if it was made
+just now. Latency and failures can be injected:
+
+    python -m bench.stub_server --port 8900 --stations 20 --latency 40 --error-rate 0.05
+"""
+import argparse
+import json
+import random
+import re
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from bench import fixtures as fixture_store
+
+DEPARTURES_PATH = re.compile(r'^/stops/([^/]+)/departures$')
+
+class Replay:
+    """Fixture payloads with their departure times stored as offsets"""
+
+    def __init__(self, fixtures, stations):
+        recorded_at = datetime.fromisoformat(fixtures['recorded_at'])
+        self.center = fixtures['center']
+        self.nearby = fixtures['nearby'][:stations]
+        self.departures = {}
+        for station in self.nearby:
+            payload = fixtures['departures'].get(station['id'], {'departures': []})
+            deps = payload['departures'] if isinstance(payload, dict) else payload
+            entries = []
+            for dep in deps:
+                offsets = {}
+                for key in ('when', 'plannedWhen'):
+                    if dep.get(key):
+                        offsets[key] = (datetime.fromisoformat(dep[key]) - recorded_at).total_seconds()
+                entries.append((dep, offsets))
+            self.departures[station['id']] = entries
+
+    def station_departures(self, station_id, results):
+        entries = self.departures.get(station_id)
+        if entries is None:
+            return None
+        now = datetime.now(timezone.utc).replace(microsecond=0)
+        deps = []
+        for dep, offsets in entries[:results]:
+            dep = dict(dep)
+            for key, offset in offsets.items():
+                dep[key] = (now + timedelta(seconds=offset)).isoformat()
+            deps.append(dep)
+        return {'departures': deps, 'realtimeDataUpdatedAt': int(now.timestamp())}
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body go out in separate writes; don't let Nagle delay them
+    disable_nagle_algorithm = True
+    replay = None
+    latency = 0.0  # seconds
+    jitter = 0.0
+    error_rate = 0.0
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+
+        delay = self.latency + random.uniform(0, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+        if self.error_rate and random.random() < self.error_rate:
+            return self._send(503, {'error': True, 'msg': 'injected failure'})
+
+        if url.path == '/locations/nearby':
+            results = int(query.get('results', 8))
+            return self._send(200, self.replay.nearby[:results])
+        if url.path == '/search':
+            lat, lon = self.replay.center
+            return self._send(200, [{'lat': str(lat), 'lon': str(lon), 'display_name': query.get('q', '')}])
+        match = DEPARTURES_PATH.match(url.path)
+        if match:
+            payload = self.replay.station_departures(match.group(1), int(query.get('results', 10)))
+            if payload is None:
+                return self._send(404, {'error': True, 'msg': 'stop not found'})
+            return self._send(200, payload)
+        return self._send(404, {'error': True, 'msg': 'not found'})
+
+    def _send(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def make_server(stations=50, port=0, latency_ms=0, jitter_ms=0, error_rate=0.0, fixtures=None):
+    """Create (but do not start) a stub server"""
+    handler = type('ConfiguredStubHandler', (StubHandler,), {
+        'replay': Replay(fixtures or fixture_store.load(), stations),
+        'latency': latency_ms / 1000,
+        'jitter': jitter_ms / 1000,
+        'error_rate': error_rate
+    })
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    server.daemon_threads = True
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=0, help='0 picks a free port')
+    parser.add_argument('--stations', type=int, default=50)
+    parser.add_argument('--latency', type=float, default=0, help='added latency per request (ms)')
+    parser.add_argument('--jitter', type=float, default=0, help='random extra latency up to this (ms)')
+    parser.add_argument('--error-rate', type=float, default=0, help='share of requests answered with 503')
+    args = parser.parse_args()
+
+    server = make_server(args.stations, args.port, args.latency, args.jitter, args.error_rate)
+    # The benchmark runner reads the port from the first line
+    print(server.server_address[1], flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    sys.exit(0)
+
+if __name__ == '__main__':
+    main()
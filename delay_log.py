@@ -0,0 +1,179 @@
+"""History of departure delays in a compact append-only file
+
+The poller records the last known delay of every trip once it has
+departed. Records are collected in a fixed-size ring buffer in memory
+and appended to the file in blocks, one column after the other:
+
+    header   magic, record count, first and last scheduled time, key bytes
+    keys     JSON list of [station, line, direction] used in the block
+    columns  scheduled times (float64), key indices (uint32), delays in
+             seconds (int16), all little-endian
+
+Delays are kept as reported and only rounded to minutes when queried.
+Blocks written before that (magic DLY1) hold delays in whole minutes.
+
+Blocks are self-contained, so any worker process can read the file while
+the poller appends to it, and queries skip blocks outside the requested
+time range without reading them.
+"""
+import json
+import math
+import os
+import struct
+import threading
+import time
+from array import array
+
+from shared_state import little_endian
+
+MAGIC = b'DLY2'
+MINUTES_MAGIC = b'DLY1'  # older blocks with delays in minutes
+HEADER = struct.Struct('<4sIddI')
+CAPACITY = 4096  # records kept in memory between flushes
+FLUSH_INTERVAL = 60  # seconds
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of a sorted list"""
+    index = max(0, min(len(sorted_values) - 1, math.ceil(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+def to_minutes(seconds):
+    """Delay in seconds rounded to whole minutes"""
+    return round(seconds / 60)
+
+class DelayRecorder:
+    """Ring buffer of delay records flushed in blocks to an append-only file"""
+
+    def __init__(self, path, capacity=CAPACITY, flush_interval=FLUSH_INTERVAL):
+        self.path = path
+        self.capacity = capacity
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._scheduled = array('d', bytes(8 * capacity))
+        self._delays = array('h', bytes(2 * capacity))
+        self._keys = [None] * capacity
+        self._start = 0
+        self._count = 0
+        self.dropped = 0
+        self._last_flush = time.monotonic()
+
+    def record(self, station_id, line, direction, scheduled, delay):
+        """Remember the delay in seconds of a departure scheduled at the timestamp `scheduled`
+
+        When the buffer is full the oldest unflushed record is overwritten.
+        """
+        with self._lock:
+            index = (self._start + self._count) % self.capacity
+            if self._count == self.capacity:
+                self._start = (self._start + 1) % self.capacity
+                self.dropped += 1
+            else:
+                self._count += 1
+            self._scheduled[index] = scheduled
+            self._delays[index] = max(-32768, min(32767, int(delay)))
+            self._keys[index] = (str(station_id), str(line), str(direction))
+
+    def _take(self):
+        """Remove and return the buffered records as (scheduled, key, delay) tuples"""
+        with self._lock:
+            indices = [(self._start + offset) % self.capacity for offset in range(self._count)]
+            records = [(self._scheduled[i], self._keys[i], self._delays[i]) for i in indices]
+            self._start = (self._start + self._count) % self.capacity
+            self._count = 0
+        return records
+
+    def pending(self):
+        """Buffered records not yet written, as (scheduled, key, delay) tuples"""
+        with self._lock:
+            indices = [(self._start + offset) % self.capacity for offset in range(self._count)]
+            return [(self._scheduled[i], self._keys[i], self._delays[i]) for i in indices]
+
+    def flush(self):
+        """Append the buffered records to the file as one block; returns their number"""
+        self._last_flush = time.monotonic()
+        records = self._take()
+        if not records:
+            return 0
+        keys = {}
+        key_indices = array('I', (keys.setdefault(key, len(keys)) for _, key, _ in records))
+        scheduled = array('d', (record[0] for record in records))
+        delays = array('h', (record[2] for record in records))
+        key_bytes = json.dumps(list(keys), separators=(',', ':')).encode()
+        block = b''.join((
+            HEADER.pack(MAGIC, len(records), min(scheduled), max(scheduled), len(key_bytes)),
+            key_bytes,
+            little_endian(scheduled).tobytes(),
+            little_endian(key_indices).tobytes(),
+            little_endian(delays).tobytes(),
+        ))
+        # A single write to a file opened for appending lands in one piece
+        with open(self.path, 'ab') as f:
+            f.write(block)
+        return len(records)
+
+    def flush_if_due(self):
+        """Flush when the flush interval has passed or the buffer is filling up"""
+        if (time.monotonic() - self._last_flush >= self.flush_interval
+                or self._count >= self.capacity // 2):
+            return self.flush()
+        return 0
+
+    def read(self, since=None, until=None):
+        """Yield (scheduled, (station, line, direction), delay in seconds) from the file and the buffer"""
+        try:
+            f = open(self.path, 'rb')
+        except FileNotFoundError:
+            f = None
+        if f is not None:
+            with f:
+                while True:
+                    header = f.read(HEADER.size)
+                    if len(header) < HEADER.size:
+                        break
+                    magic, count, first, last, key_size = HEADER.unpack(header)
+                    if magic not in (MAGIC, MINUTES_MAGIC):
+                        break  # a torn or foreign block; nothing after it can be trusted
+                    body_size = key_size + count * (8 + 4 + 2)
+                    if since is not None and last < since or until is not None and first > until:
+                        f.seek(body_size, os.SEEK_CUR)
+                        continue
+                    body = f.read(body_size)
+                    if len(body) < body_size:
+                        break
+                    keys = [tuple(key) for key in json.loads(body[:key_size])]
+                    offset = key_size
+                    scheduled = little_endian(array('d', body[offset:offset + 8 * count]))
+                    offset += 8 * count
+                    key_indices = little_endian(array('I', body[offset:offset + 4 * count]))
+                    offset += 4 * count
+                    delays = little_endian(array('h', body[offset:offset + 2 * count]))
+                    if magic == MINUTES_MAGIC:
+                        delays = [delay * 60 for delay in delays]
+                    for timestamp, key_index, delay in zip(scheduled, key_indices, delays):
+                        yield timestamp, keys[key_index], delay
+        yield from self.pending()
+
+    def percentiles(self, since=None, station_id=None, line=None, percents=(50, 90, 95)):
+        """Delay statistics in minutes per line and direction, busiest first"""
+        samples = {}
+        for timestamp, (station, line_name, direction), delay in self.read(since):
+            if since is not None and timestamp < since:
+                continue
+            if station_id is not None and station != station_id or line is not None and line_name != line:
+                continue
+            samples.setdefault((line_name, direction), []).append(delay)
+        results = []
+        for (line_name, direction), delays in samples.items():
+            delays.sort()
+            result = {
+                'line': line_name,
+                'direction': direction,
+                'count': len(delays),
+                'mean': round(sum(delays) / len(delays) / 60, 2),
+                'max': to_minutes(delays[-1]),
+            }
+            for pct in percents:
+                result[f'p{pct}'] = to_minutes(percentile(delays, pct))
+            results.append(result)
+        results.sort(key=lambda result: (-result['count'], result['line'], result['direction']))
+        return results
@@ -0,0 +1,381 @@
+"""Departure processing: from raw VBB departures to departure board rows
+
+The pipeline is independent of Flask and the upstream API so it can be
+used by the HTML board, the JSON API and the benchmarks alike.
+"""
+import hashlib
+import heapq
+from bisect import bisect_left
+from datetime import datetime, timezone
+from operator import itemgetter
+
+NEXT_DEPARTURES = 3  # departures shown per line and direction
+EVICT_AFTER = 60  # seconds after a departure before it is dropped
+DEPARTED_MEMORY = 30 * 60  # seconds a departed trip is remembered as recorded
+
+def get_line_type(line_name, line_product=None):
+    """Determine BVG line type"""
+    if not line_name or line_name == 'N/A':
+        return 'bus'
+
+    line_name = str(line_name).upper().replace(' ', '')
+
+    if line_product:
+        product = str(line_product).lower()
+        if 'tram' in product:
+            return 'tram'
+        elif 'bus' in product:
+            return 'bus'
+        elif 'subway' in product or 'metro' in product:
+            return line_name.lower() if line_name.startswith('U') else 'u'
+        elif 'suburban' in product:
+            return line_name.lower() if line_name.startswith('S') else 's'
+
+    if line_name.startswith('S'):
+        return line_name.lower()
+    elif line_name.startswith('U'):
+        return line_name.lower()
+    elif line_name.startswith(('RE', 'RB', 'IC', 'ICE')):
+        return 'regional'
+    else:
+        return 'bus'
+
+def row_id(station_id, line_name, direction):
+    """Stable short ID of a board row"""
+    return hashlib.sha1(f"{station_id}|{line_name}|{direction}".encode()).hexdigest()[:10]
+
+class Departure:
+    """One upstream departure with its timestamp parsed"""
+    __slots__ = ('when', 'line_name', 'line_product', 'direction', 'delay', 'platform',
+                 'trip_id', 'timestamp', 'signature', 'planned', 'delay_seconds')
+
+    def __init__(self, when: datetime, line_name: str, line_product, direction: str,
+                 delay: int, platform: str, trip_id=None, signature=None,
+                 planned=None, delay_seconds=None):
+        self.when = when
+        self.line_name = line_name
+        self.line_product = line_product
+        self.direction = direction
+        self.delay = delay  # minutes, None without realtime data
+        self.platform = platform
+        self.trip_id = trip_id
+        self.timestamp = when.timestamp()
+        self.signature = signature  # raw fields the departure was parsed from
+        self.planned = planned  # scheduled timestamp, None if unknown
+        self.delay_seconds = delay_seconds  # as reported upstream, None without realtime data
+
+    @classmethod
+    def from_api(cls, dep):
+        """Build a departure from a transport.rest dict, None if it has no time"""
+        when = dep.get('when')
+        if not when:
+            return None
+        signature = departure_signature(dep)
+        when = parse_time(when)
+        planned = dep.get('plannedWhen')
+        planned = parse_time(planned).timestamp() if planned else None
+        line = dep.get('line') or {}
+        delay = dep.get('delay')
+        return cls(
+            when,
+            line.get('name', 'N/A'),
+            line.get('product', None),
+            dep.get('direction', 'N/A'),
+            int(delay / 60) if delay is not None else None,
+            dep.get('platform') or '',
+            trip_key(dep),
+            signature,
+            planned,
+            delay
+        )
+
+def parse_time(value):
+    """Timezone-aware datetime of an ISO 8601 time from the API"""
+    when = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if when.tzinfo is None:
+        when = when.astimezone()  # naive times are local time
+    return when
+
+def trip_key(dep):
+    """Key identifying one trip at one stop across fetches"""
+    trip_id = dep.get('tripId')
+    if trip_id:
+        return trip_id
+    line = dep.get('line') or {}
+    return f"{line.get('name')}|{dep.get('direction')}|{dep.get('plannedWhen') or dep.get('when')}"
+
+def departure_signature(dep):
+    """The fields of a raw departure that end up on the board"""
+    line = dep.get('line') or {}
+    return (dep.get('when'), dep.get('delay'), dep.get('platform'), dep.get('direction'),
+            line.get('name'), line.get('product'))
+
+class BoardRow:
+    """One line and direction at one station, as shown on the board"""
+    __slots__ = ('id', 'station_name', 'line', 'line_type', 'direction', 'minutes',
+                 'next_times', 'platform', 'urgency', 'leave_in_minutes', 'delay', 'age')
+
+    def __init__(self, id: str, station_name: str, line: str, line_type: str, direction: str,
+                 minutes: int, next_times: list, platform: str, urgency: str,
+                 leave_in_minutes: int, delay, age=None):
+        self.id = id
+        self.station_name = station_name
+        self.line = line
+        self.line_type = line_type
+        self.direction = direction
+        self.minutes = minutes
+        self.next_times = next_times
+        self.platform = platform
+        self.urgency = urgency
+        self.leave_in_minutes = leave_in_minutes
+        self.delay = delay
+        self.age = age  # minutes since the departures were fetched, if stale
+
+    def _values(self):
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def __eq__(self, other):
+        if not isinstance(other, BoardRow):
+            return NotImplemented
+        return self._values() == other._values()
+
+    def as_dict(self):
+        return dict(zip(self.__slots__, self._values()))
+
+    def content_key(self):
+        """Hashable form of everything shown in the row"""
+        return tuple(tuple(value) if isinstance(value, list) else value for value in self._values())
+
+def get_urgency(leave_in_minutes):
+    """Classify how soon one has to leave"""
+    if leave_in_minutes <= 0:
+        return 'now'
+    elif leave_in_minutes <= 3:
+        return 'soon'
+    return 'later'
+
+def build_row(station, walk_time, line_name, direction, next_deps, age):
+    """Board row of one line and direction from its next (minutes, departure) pairs"""
+    minutes, first_dep = next_deps[0]
+    leave_in_minutes = minutes - walk_time
+    return BoardRow(
+        row_id(station['id'], line_name, direction),
+        station['name'],
+        line_name,
+        get_line_type(line_name, first_dep.line_product),
+        direction,
+        minutes,
+        [dep_minutes for dep_minutes, _ in next_deps[1:]],
+        first_dep.platform,
+        get_urgency(leave_in_minutes),
+        leave_in_minutes,
+        first_dep.delay if first_dep.delay and first_dep.delay > 0 else None,
+        age
+    )
+
+class DepartureGroup:
+    """Departures of one line and direction at a station, sorted by time"""
+    __slots__ = ('timestamps', 'departures', 'version', 'rows')
+
+    def __init__(self):
+        self.timestamps = []
+        self.departures = []
+        self.version = 0  # bumped on every change
+        self.rows = {}  # board parameters -> (version, next departures, row)
+
+    def add(self, dep):
+        index = bisect_left(self.timestamps, dep.timestamp)
+        self.timestamps.insert(index, dep.timestamp)
+        self.departures.insert(index, dep)
+        self.version += 1
+
+    def discard(self, dep):
+        index = bisect_left(self.timestamps, dep.timestamp)
+        while index < len(self.departures):
+            if self.departures[index] is dep:
+                del self.timestamps[index]
+                del self.departures[index]
+                self.version += 1
+                return
+            index += 1
+
+    def evict_before(self, timestamp):
+        """Drop departures before timestamp and return them"""
+        index = bisect_left(self.timestamps, timestamp)
+        evicted = self.departures[:index]
+        if index:
+            del self.timestamps[:index]
+            del self.departures[:index]
+            self.version += 1
+        return evicted
+
+    def row(self, station, walk_time, min_minutes, max_minutes, now, age):
+        """(time of the first departure in the window, board row) of this group
+
+        None if no departure is in the window.
+
+        Only the departures that can fall into the window are looked at,
+        and the last row is reused while neither the group nor the minute
+        values it shows have changed.
+        """
+        now_ts = now.timestamp()
+        lowest = max(min_minutes, walk_time)
+        # A minute earlier/later than the window: minutes are truncated
+        start = bisect_left(self.timestamps, now_ts + (lowest - 1) * 60)
+        end = bisect_left(self.timestamps, now_ts + (max_minutes + 1) * 60, start)
+        candidates = []
+        for dep in self.departures[start:end]:
+            minutes_until = int((dep.timestamp - now_ts) / 60)
+            if lowest <= minutes_until <= max_minutes:
+                candidates.append((minutes_until + (dep.delay or 0), dep))
+        if not candidates:
+            return None
+
+        next_deps = tuple(heapq.nsmallest(NEXT_DEPARTURES, candidates, key=itemgetter(0)))
+        params = (walk_time, min_minutes, max_minutes)
+        cached = self.rows.get(params)
+        first_timestamp = candidates[0][1].timestamp
+        if cached is not None and cached[0] == self.version and cached[1] == next_deps and cached[2].age == age:
+            return first_timestamp, cached[2]
+        first_dep = next_deps[0][1]
+        row = build_row(station, walk_time, first_dep.line_name, first_dep.direction, next_deps, age)
+        self.rows[params] = (self.version, next_deps, row)
+        return first_timestamp, row
+
+class StationState:
+    """Departures of one station kept across fetches, keyed by trip
+
+    `merge` folds a new fetch in: unchanged trips are not parsed again,
+    changed ones move within their group, and trips the upstream no longer
+    returns are dropped. Board rows are then rebuilt only for groups that
+    changed or whose shown minutes ticked over.
+
+    `on_departed` is called with every departure that leaves, either
+    because the upstream stopped returning it once it was due or because
+    it was evicted. It is called once per trip.
+    """
+
+    def __init__(self, on_departed=None):
+        self.trips = {}
+        self.groups = {}
+        self.fetched_at = None
+        self.on_departed = on_departed
+        # trip key -> timestamp of trips passed to on_departed, which the
+        # upstream may still list for a while after they were evicted
+        self.departed = {}
+
+    def _group(self, dep):
+        key = (dep.line_name, dep.direction)
+        group = self.groups.get(key)
+        if group is None:
+            group = self.groups[key] = DepartureGroup()
+        return group
+
+    def _remove(self, dep):
+        key = (dep.line_name, dep.direction)
+        group = self.groups.get(key)
+        if group is not None:
+            group.discard(dep)
+            if not group.departures:
+                del self.groups[key]
+
+    def _departed(self, key, dep):
+        if key in self.departed:
+            return
+        self.departed[key] = dep.timestamp
+        if self.on_departed is not None:
+            self.on_departed(dep)
+
+    def merge(self, raw_departures, fetched_at=None):
+        """Fold a fetch into the state; returns the number of trips that changed"""
+        changed = 0
+        seen = set()
+        for raw in raw_departures:
+            try:
+                key = trip_key(raw)
+                current = self.trips.get(key)
+                if current is not None and current.signature == departure_signature(raw):
+                    seen.add(key)
+                    continue
+                dep = Departure.from_api(raw)
+            except Exception:
+                continue
+            if dep is None:
+                continue
+            if current is not None:
+                self._remove(current)
+            self.trips[key] = dep
+            self._group(dep).add(dep)
+            seen.add(key)
+            changed += 1
+        for key in [key for key in self.trips if key not in seen]:
+            dep = self.trips.pop(key)
+            self._remove(dep)
+            # Trips dropped before they were due fell off the limit; they have not left
+            if fetched_at is not None and dep.timestamp <= fetched_at:
+                self._departed(key, dep)
+            changed += 1
+        self.fetched_at = fetched_at
+        return changed
+
+    def evict(self, now):
+        """Drop departures that left more than a minute ago"""
+        cutoff = now.timestamp() - EVICT_AFTER
+        for key in [key for key, timestamp in self.departed.items() if timestamp < cutoff - DEPARTED_MEMORY]:
+            del self.departed[key]
+        for key in [key for key, group in self.groups.items() if group.timestamps[0] < cutoff]:
+            group = self.groups[key]
+            for dep in group.evict_before(cutoff):
+                self.trips.pop(dep.trip_id, None)
+                self._departed(dep.trip_id, dep)
+            if not group.departures:
+                del self.groups[key]
+
+    def next_departure(self, after):
+        """Timestamp of the first departure at or after the timestamp `after`, None if none is known"""
+        first = None
+        for group in self.groups.values():
+            index = bisect_left(group.timestamps, after)
+            if index < len(group.timestamps) and (first is None or group.timestamps[index] < first):
+                first = group.timestamps[index]
+        return first
+
+    def last_departure(self):
+        """Timestamp of the last known departure, None if there is none"""
+        return max((group.timestamps[-1] for group in self.groups.values()), default=None)
+
+    def rows(self, station, walk_time, min_minutes, max_minutes, now, age=None):
+        """Board rows of this station
+
+        Departures are kept if they leave between min_minutes and max_minutes
+        from now and can still be reached on foot, with the next three times
+        per line and direction. `age` marks rows built from stale departures.
+        """
+        rows = []
+        for group in self.groups.values():
+            row = group.row(station, walk_time, min_minutes, max_minutes, now, age)
+            if row is not None:
+                rows.append(row)
+        # Like the upstream list: by time of each group's first departure,
+        # with line and direction breaking ties so the order stays stable
+        rows.sort(key=lambda entry: (entry[0], entry[1].line, entry[1].direction))
+        return [row for _, row in rows]
+
+def board_sort_key(row):
+    """Most urgent rows first"""
+    return row.leave_in_minutes if row.leave_in_minutes > 0 else -1
+
+def process_board(stations, min_minutes, max_minutes, now=None):
+    """Build the sorted board rows for several stations
+
+    `stations` yields (station, walk_time, state, age) with the
+    StationState of each station. All stations are evaluated against the
+    same `now`.
+    """
+    if now is None:
+        now = datetime.now(timezone.utc)
+    rows = []
+    for station, walk_time, state, age in stations:
+        rows.extend(state.rows(station, walk_time, min_minutes, max_minutes, now, age))
+    rows.sort(key=board_sort_key)
+    return rows
@@ -0,0 +1,180 @@
+"""Address lookup without a round trip to Nominatim
+
+Two layers sit in front of Nominatim:
+
+- a persistent cache of earlier lookups, keyed by the normalised address
+- an optional local address index (SQLite with a full-text table) that can
+  be built from a CSV export of Berlin addresses, e.g. OSM addr:* data:
+
+    python geocoding.py build berlin_addresses.csv addresses.db
+
+  The CSV needs a header with either `address,lat,lon` or
+  `street,housenumber,postcode,lat,lon` columns.
+
+Berlin has many streets of the same name, so keys keep the postcode. A
+key without one is only resolved when it names a single address.
+"""
+import csv
+import json
+import os
+import re
+import sqlite3
+import sys
+import threading
+import unicodedata
+
+from shared_state import atomic_write
+
+# Words that say nothing about where in Berlin an address is
+NOISE_WORDS = {'berlin', 'germany', 'deutschland'}
+
+POSTCODE = re.compile(r'1[0-4]\d{3}')
+
+ABBREVIATIONS = [
+    (re.compile(r'str\b\.?'), 'strasse'),
+    (re.compile(r'pl\b\.?'), 'platz'),
+]
+
+def normalize_address(address):
+    """Canonical form of an address used as lookup key
+
+    'Karl-Marx-Str. 5a, 12043 Berlin' and 'karl marx straße 5 A 12043'
+    both become 'karl marx strasse 5a 12043'; without a postcode the key
+    is just 'karl marx strasse 5a'.
+    """
+    text = unicodedata.normalize('NFKC', str(address)).lower().replace('ß', 'ss')
+    for pattern, replacement in ABBREVIATIONS:
+        text = pattern.sub(replacement, text)
+    text = re.sub(r'[^\w\s]', ' ', text).replace('_', ' ')
+    postcodes = [word for word in text.split() if POSTCODE.fullmatch(word)]
+    words = [word for word in text.split() if word not in NOISE_WORDS and not POSTCODE.fullmatch(word)]
+    # House number suffixes: '5 a' -> '5a'
+    street = re.sub(r'\b(\d+) ([a-z])\b', r'\1\2', ' '.join(words))
+    return f"{street} {postcodes[0]}" if postcodes else street
+
+def split_key(key):
+    """(key without postcode, postcode or None) of a normalised address"""
+    street, _, last = key.rpartition(' ')
+    if street and POSTCODE.fullmatch(last):
+        return street, last
+    return key, None
+
+CACHE_VERSION = 2  # version 1 keys had no postcode and mixed up districts
+
+class GeocodeCache:
+    """Persistent mapping of normalised address to coordinates"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._entries = {}
+        try:
+            if os.path.exists(path):
+                with open(path, 'r') as f:
+                    saved = json.load(f)
+                if isinstance(saved, dict) and saved.get('version') == CACHE_VERSION:
+                    self._entries = saved.get('entries', {})
+        except Exception:
+            pass
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        return (entry[0], entry[1]) if entry else None
+
+    def put(self, key, lat, lon):
+        with self._lock:
+            self._entries[key] = [lat, lon]
+            try:
+                with atomic_write(self.path) as f:
+                    json.dump({'version': CACHE_VERSION, 'entries': self._entries}, f)
+            except Exception:
+                pass
+
+class AddressIndex:
+    """Read-only local address index built by `build_index`"""
+
+    def __init__(self, path):
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+        columns = [row[1] for row in self._db.execute("PRAGMA table_info(addresses)")]
+        if 'street_key' not in columns:
+            raise sqlite3.DatabaseError(f"{path} was built by an older version, build it again")
+        self._has_fts = bool(self._db.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'addresses_fts'").fetchone())
+
+    @classmethod
+    def open(cls, path):
+        """Open the index at path, None if there is none"""
+        if not os.path.exists(path):
+            return None
+        try:
+            return cls(path)
+        except sqlite3.Error:
+            return None
+
+    def lookup(self, key):
+        """Coordinates of a normalised address, None if unknown or ambiguous"""
+        if not key:
+            return None
+        street, postcode = split_key(key)
+        with self._lock:
+            row = self._db.execute("SELECT lat, lon FROM addresses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                # Without (the right) postcode only an address that exists once will do
+                rows = self._db.execute(
+                    "SELECT lat, lon FROM addresses WHERE street_key = ? LIMIT 2", (street,)).fetchall()
+                row = rows[0] if len(rows) == 1 else None
+            if row is None and self._has_fts:
+                # Every word has to match, so a house number is never dropped
+                query = ' '.join(f'"{word}"' for word in key.split())
+                rows = self._db.execute(
+                    "SELECT a.lat, a.lon FROM addresses_fts f JOIN addresses a ON a.rowid = f.rowid "
+                    "WHERE addresses_fts MATCH ? ORDER BY rank LIMIT 2", (query,)).fetchall()
+                # With a postcode all matches are in one district; without
+                # one, several matches may be the same street in different ones
+                if rows and (postcode is not None or len(rows) == 1):
+                    row = rows[0]
+        return (row[0], row[1]) if row else None
+
+def read_addresses(csv_path):
+    """Yield (address, lat, lon) from a CSV export"""
+    with open(csv_path, newline='', encoding='utf-8') as f:
+        for record in csv.DictReader(f):
+            if record.get('address'):
+                address = record['address']
+            else:
+                address = f"{record.get('street', '')} {record.get('housenumber', '')} {record.get('postcode', '')}"
+            try:
+                yield address, float(record['lat']), float(record['lon'])
+            except (KeyError, TypeError, ValueError):
+                continue
+
+def build_index(csv_path, db_path):
+    """Build the SQLite address index from a CSV export; returns the row count"""
+    if os.path.exists(db_path):
+        os.remove(db_path)
+    db = sqlite3.connect(db_path)
+    db.execute("CREATE TABLE addresses (key TEXT PRIMARY KEY, street_key TEXT, lat REAL, lon REAL)")
+    db.executemany(
+        "INSERT OR IGNORE INTO addresses (key, street_key, lat, lon) VALUES (?, ?, ?, ?)",
+        ((key, split_key(key)[0], lat, lon)
+         for key, lat, lon in ((normalize_address(address), lat, lon)
+                               for address, lat, lon in read_addresses(csv_path)))
+    )
+    db.execute("CREATE INDEX addresses_street ON addresses (street_key)")
+    try:
+        db.execute("CREATE VIRTUAL TABLE addresses_fts USING fts5(key, content='addresses')")
+        db.execute("INSERT INTO addresses_fts (rowid, key) SELECT rowid, key FROM addresses")
+    except sqlite3.OperationalError:
+        pass  # SQLite without FTS5: exact lookups only
+    db.commit()
+    count = db.execute("SELECT COUNT(*) FROM addresses").fetchone()[0]
+    db.execute("VACUUM")
+    db.close()
+    return count
+
+if __name__ == '__main__':
+    if len(sys.argv) != 4 or sys.argv[1] != 'build':
+        print(__doc__)
+        sys.exit(1)
+    print(f"Indexed {build_index(sys.argv[2], sys.argv[3])} addresses into {sys.argv[3]}")
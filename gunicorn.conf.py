@@ -0,0 +1,30 @@
+"""gunicorn settings for the departure board
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+BIND, WEB_CONCURRENCY and THREADS override the address, the number of
+workers and the threads per worker.
+"""
+import multiprocessing
+import os
+
+bind = os.environ.get('BIND', '0.0.0.0:5001')
+
+# One worker per core; the Pi has four
+workers = int(os.environ.get('WEB_CONCURRENCY', min(multiprocessing.cpu_count(), 4)))
+
+# Every open /stream connection holds a thread, so requests run in threads.
+# A worker accepts at most MAX_STREAMS of them and answers further ones with
+# 503, keeping the remaining threads free for pages and the API.
+worker_class = 'gthread'
+threads = int(os.environ.get('THREADS', 32))
+os.environ.setdefault('MAX_STREAMS', str(max(1, threads - 8)))
+keepalive = 5
+timeout = 30
+graceful_timeout = 10
+
+# Threads do not survive a fork: each worker imports the app itself
+preload_app = False
+
+accesslog = None
+errorlog = '-'
@@ -0,0 +1,218 @@
+"""Shared HTTP transport for the upstream APIs (VBB and Nominatim)
+
+requests is only imported when the first call is made: importing it
+takes a noticeable part of a cold start on a Pi, and a board restored
+from disk can be served before any upstream call.
+"""
+import random
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+import metrics
+
+USER_AGENT = 'BVG-Departure-Board/1.0'
+
+# Nominatim's usage policy allows a single request at a time per client
+HOST_CONCURRENCY = {
+    'nominatim.openstreetmap.org': 1,
+}
+
+class UpstreamError(Exception):
+    """An upstream API call failed"""
+
+class CircuitOpenError(UpstreamError):
+    """The endpoint failed repeatedly and is not being called for now"""
+
+class CircuitBreaker:
+    """Stop calling an endpoint for a while after repeated failures
+
+    After `failure_threshold` consecutive failures the circuit opens and
+    calls fail immediately. Once `reset_timeout` seconds have passed a
+    single probe call is let through; its outcome closes or re-opens it.
+    """
+
+    def __init__(self, failure_threshold=3, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if self._probing or time.monotonic() - self.opened_at >= self.reset_timeout:
+            return 'half-open'
+        return 'open'
+
+    def allow(self):
+        """Whether a call may be made now"""
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if not self._probing and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._probing or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+                self._probing = False
+
+def jittered_retry(**kwargs):
+    """urllib3 retry policy adding full jitter to the exponential backoff"""
+    from urllib3.util.retry import Retry
+
+    class JitteredRetry(Retry):
+        def get_backoff_time(self):
+            backoff = super().get_backoff_time()
+            return random.uniform(0, backoff) if backoff > 0 else 0
+
+    return JitteredRetry(**kwargs)
+
+class UpstreamClient:
+    """Keep-alive session with a connection pool and per-host request limits"""
+
+    def __init__(self, pool_size=8, host_concurrency=None, retries=2, backoff_factor=0.5,
+                 failure_threshold=3, reset_timeout=30):
+        self.pool_size = pool_size
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.host_concurrency = dict(HOST_CONCURRENCY)
+        self.host_concurrency.update(host_concurrency or {})
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.adapter = None
+        self._session = None
+
+        self._lock = threading.Lock()
+        self._host_limits = {}
+        self._breakers = {}
+
+    @property
+    def session(self):
+        """The keep-alive session, created on first use"""
+        with self._lock:
+            if self._session is None:
+                import requests
+                from requests.adapters import HTTPAdapter
+
+                # Only connection problems and gateway errors are retried; a read
+                # timeout has already used up the caller's time budget.
+                retry = jittered_retry(
+                    total=self.retries,
+                    connect=self.retries,
+                    read=0,
+                    status=self.retries,
+                    backoff_factor=self.backoff_factor,
+                    status_forcelist=(502, 503, 504),
+                    allowed_methods=frozenset(['GET']),
+                    raise_on_status=False
+                )
+                self.adapter = HTTPAdapter(pool_connections=4, pool_maxsize=self.pool_size, max_retries=retry)
+
+                session = requests.Session()
+                session.mount('https://', self.adapter)
+                session.mount('http://', self.adapter)
+                session.headers.update({
+                    'User-Agent': USER_AGENT,
+                    'Accept': 'application/json',
+                    'Accept-Encoding': 'gzip, deflate'
+                })
+                self._session = session
+            return self._session
+
+    def _host_limit(self, host):
+        with self._lock:
+            limit = self._host_limits.get(host)
+            if limit is None:
+                limit = threading.BoundedSemaphore(self.host_concurrency.get(host, self.pool_size))
+                self._host_limits[host] = limit
+            return limit
+
+    @contextmanager
+    def _slot(self, url):
+        limit = self._host_limit(urlsplit(url).hostname)
+        with limit:
+            yield
+
+    def breaker(self, endpoint):
+        """The circuit breaker guarding an endpoint"""
+        with self._lock:
+            breaker = self._breakers.get(endpoint)
+            if breaker is None:
+                breaker = CircuitBreaker(self.failure_threshold, self.reset_timeout)
+                self._breakers[endpoint] = breaker
+            return breaker
+
+    def get(self, url, params=None, headers=None, timeout=10, endpoint=None):
+        """GET a URL through the shared session
+
+        Calls to the same `endpoint` (default: the host) share a circuit
+        breaker. Raises CircuitOpenError without calling while it is open,
+        and UpstreamError for connection problems and timeouts.
+        """
+        endpoint = endpoint or urlsplit(url).hostname
+        breaker = self.breaker(endpoint)
+        if not breaker.allow():
+            metrics.upstream_errors.inc(endpoint=endpoint, reason='circuit_open')
+            raise CircuitOpenError(f"{endpoint} is failing, not calling it for now")
+        session = self.session
+        import requests  # loaded by now
+        try:
+            with self._slot(url), metrics.upstream_request_seconds.time(endpoint=endpoint):
+                response = session.get(url, params=params, headers=headers, timeout=timeout)
+        except requests.Timeout as e:
+            breaker.record_failure()
+            metrics.upstream_timeouts.inc(endpoint=endpoint)
+            metrics.upstream_errors.inc(endpoint=endpoint, reason='timeout')
+            raise UpstreamError(str(e)) from e
+        except requests.RequestException as e:
+            breaker.record_failure()
+            metrics.upstream_errors.inc(endpoint=endpoint, reason='connection')
+            raise UpstreamError(str(e)) from e
+        if response.status_code >= 500 or response.status_code == 429:
+            breaker.record_failure()
+            metrics.upstream_errors.inc(endpoint=endpoint, reason=f"http_{response.status_code}")
+        else:
+            breaker.record_success()
+        return response
+
+    def breaker_states(self):
+        """Current state of every circuit breaker"""
+        with self._lock:
+            breakers = dict(self._breakers)
+        return {endpoint: breaker.state for endpoint, breaker in breakers.items()}
+
+    def pool_stats(self):
+        """Connection pool counters per host
+
+        A hit is a request served on a reused keep-alive connection, a miss
+        one that had to open a new connection.
+        """
+        stats = {}
+        if self.adapter is None:
+            return stats
+        pools = self.adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            host = stats.setdefault(pool.host, {'requests': 0, 'pool_hits': 0, 'pool_misses': 0})
+            host['requests'] += pool.num_requests
+            host['pool_misses'] += pool.num_connections
+            host['pool_hits'] += max(pool.num_requests - pool.num_connections, 0)
+        return stats
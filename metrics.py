@@ -0,0 +1,209 @@
+"""Prometheus-style metrics kept in process memory
+
+Counters and histograms are rendered in the Prometheus text exposition
+format by `REGISTRY.render()`; no client library is needed.
+
+Each process only sees its own values. `REGISTRY.state()` exports them as
+JSON-able data, and `render()` adds up the states of other processes
+passed to it: counters and histograms are summed, gauges take the
+highest value.
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in labels) + '}'
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    """Monotonically increasing value per label set"""
+    type = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(label, '')) for label in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        key = tuple(str(labels.get(label, '')) for label in self.labels)
+        return self._values.get(key, 0)
+
+    def state(self):
+        """Values as JSON-able [label values, value] pairs"""
+        with self._lock:
+            return [[list(key), value] for key, value in self._values.items()]
+
+    def samples(self, shared=()):
+        """Samples of this process plus the states of other processes"""
+        with self._lock:
+            values = dict(self._values)
+        for state in shared:
+            for key, value in state:
+                key = tuple(key)
+                values[key] = values.get(key, 0) + value
+        for key, value in sorted(values.items()):
+            yield self.name, tuple(zip(self.labels, key)), value
+
+class Histogram:
+    """Distribution of observed values in cumulative buckets"""
+    type = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(label, '')) for label in self.labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the duration of a `with` block in seconds"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def state(self):
+        """Series as JSON-able [label values, bucket counts, sum, count] lists"""
+        with self._lock:
+            return [[list(key), list(counts), total, count] for key, (counts, total, count) in self._series.items()]
+
+    def samples(self, shared=()):
+        """Samples of this process plus the states of other processes"""
+        with self._lock:
+            series = {key: (list(counts), total, count) for key, (counts, total, count) in self._series.items()}
+        for state in shared:
+            for key, counts, total, count in state:
+                key = tuple(key)
+                if key in series:
+                    mine = series[key]
+                    counts = [a + b for a, b in zip(mine[0], counts)]
+                    total += mine[1]
+                    count += mine[2]
+                series[key] = (counts, total, count)
+        for key, (counts, total, count) in sorted(series.items()):
+            labels = tuple(zip(self.labels, key))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                yield f"{self.name}_bucket", labels + (('le', _format_value(bound)),), cumulative
+            yield f"{self.name}_sum", labels, total
+            yield f"{self.name}_count", labels, count
+
+class Registry:
+    """Collection of metrics rendered together"""
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def counter(self, name, help, labels=()):
+        metric = Counter(name, help, labels)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        metric = Histogram(name, help, labels, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collect):
+        """Register a callable returning (name, type, help, [(labels, value), ...]) tuples
+
+        Collectors export values owned elsewhere, read at scrape time.
+        """
+        self._collectors.append(collect)
+
+    def _collect(self):
+        """Collector output as JSON-able [name, type, help, [[labels, value], ...]] lists"""
+        return [[name, metric_type, help, [[dict(labels), value] for labels, value in samples]]
+                for collect in self._collectors
+                for name, metric_type, help, samples in collect()]
+
+    def state(self):
+        """Everything render() shows, for another process to add to its own"""
+        return {
+            'metrics': {metric.name: metric.state() for metric in self._metrics},
+            'collected': self._collect(),
+        }
+
+    def render(self, shared=()):
+        """Metrics in the text exposition format, including the states in `shared`"""
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            states = [state['metrics'].get(metric.name, []) for state in shared]
+            for name, labels, value in metric.samples(states):
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        collected = {}  # name -> (type, help, {labels: value})
+        for source in [self._collect()] + [state['collected'] for state in shared]:
+            for name, metric_type, help, samples in source:
+                values = collected.setdefault(name, (metric_type, help, {}))[2]
+                for labels, value in samples:
+                    key = tuple(labels.items())
+                    if key not in values:
+                        values[key] = value
+                    elif metric_type == 'counter':
+                        values[key] += value
+                    else:
+                        values[key] = max(values[key], value)
+        for name, (metric_type, help, values) in collected.items():
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            for labels, value in values.items():
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return '\n'.join(lines) + '\n'
+
+REGISTRY = Registry()
+
+upstream_request_seconds = REGISTRY.histogram(
+    'departure_board_upstream_request_seconds', 'Duration of upstream API calls', ('endpoint',))
+upstream_errors = REGISTRY.counter(
+    'departure_board_upstream_errors_total', 'Failed upstream API calls', ('endpoint', 'reason'))
+upstream_timeouts = REGISTRY.counter(
+    'departure_board_upstream_timeouts_total', 'Upstream API calls that timed out', ('endpoint',))
+stage_seconds = REGISTRY.histogram(
+    'departure_board_stage_seconds', 'Duration of departure board pipeline stages', ('stage',))
+cache_hits = REGISTRY.counter(
+    'departure_board_cache_hits_total', 'Lookups answered from a cache', ('cache',))
+cache_misses = REGISTRY.counter(
+    'departure_board_cache_misses_total', 'Lookups that had to go upstream', ('cache',))
+station_polls = REGISTRY.counter(
+    'departure_board_station_polls_total', 'Stations fetched or skipped by the poll scheduler', ('outcome',))
+delays_recorded = REGISTRY.counter(
+    'departure_board_delays_recorded_total', 'Departed trips whose delay was recorded')
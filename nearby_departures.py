@@ -1,10 +1,32 @@
-from flask import Flask, render_template, request, redirect, url_for, jsonify
-import requests
+import time
+
+# Taken before the imports below so that the time to the first board includes them
+STARTED = time.monotonic()
+
+from flask import Flask, render_template, request, redirect, url_for, jsonify, Response, g, has_request_context
+from markupsafe import Markup, escape
+import atexit
+import hashlib
 import json
-import os
-from datetime import datetime
 import math
-from collections import defaultdict
+import os
+import threading
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from functools import lru_cache, partial
+
+import metrics
+from delay_log import DelayRecorder
+from departure_pipeline import BoardRow, StationState, process_board
+from geocoding import AddressIndex, GeocodeCache, normalize_address
+from http_client import CircuitOpenError, UpstreamClient
+from poll_scheduler import PollScheduler
+import settings_store
+from settings_store import SettingsStore
+from shared_state import ProcessLock, SnapshotStore, atomic_write
+from stop_index import StopIndex
+from walking import WalkingModel, calculate_distance
 
 app = Flask(__name__)
 
@@ -22,30 +44,68 @@ default_settings = {
     'max_minutes': 30,
     'show_platform': True,
     'selected_stations': [],  # List of selected station IDs
-    'language': 'de'  # Default to German
+    'language': 'de',  # Default to German
+    'poll_interval': 30,  # seconds between background departure refreshes
+    'server_timing': False,  # add a Server-Timing header to responses
+    'boards': {}  # named board profiles, see get_board_settings()
+}
+
+# Settings a board profile can override
+BOARD_KEYS = ('address', 'latitude', 'longitude', 'max_walk_minutes', 'max_departures_per_station',
+              'min_minutes', 'max_minutes', 'show_platform', 'selected_stations')
+
+def board_profiles(value):
+    """Board profiles with their values checked; invalid profiles are dropped with a warning"""
+    settings_store.mapping(value)
+    profiles = {}
+    for name, profile in value.items():
+        try:
+            settings_store.mapping(profile)
+            checked = {}
+            for key in BOARD_KEYS:
+                if key in profile:
+                    try:
+                        checked[key] = SETTINGS_SCHEMA[key](profile[key])
+                    except ValueError as e:
+                        raise ValueError(f"{key}: {e}") from None
+        except ValueError as e:
+            app.logger.warning("Ignoring board %s: %s", name, e)
+            continue
+        profiles[name] = dict(profile, **checked)
+    return profiles
+
+# What each setting may hold; see settings_store.py
+SETTINGS_SCHEMA = {
+    'address': settings_store.string,
+    'latitude': settings_store.number(-90, 90, optional=True),
+    'longitude': settings_store.number(-180, 180, optional=True),
+    'max_walk_minutes': settings_store.integer(1, 60),
+    'max_departures_per_station': settings_store.integer(1, 100),
+    'min_minutes': settings_store.integer(0, 120),
+    'max_minutes': settings_store.integer(1, 120),
+    'show_platform': settings_store.boolean,
+    'selected_stations': settings_store.string_list,
+    'language': settings_store.choice('de', 'en'),
+    'poll_interval': settings_store.integer(5, 3600),
+    'server_timing': settings_store.boolean,
+    'boards': board_profiles
 }
 
 def load_settings():
     """Load settings from file or return defaults"""
-    try:
-        if os.path.exists(SETTINGS_FILE):
-            with open(SETTINGS_FILE, 'r') as f:
-                saved_settings = json.load(f)
-                # Merge with defaults to ensure all keys exist
-                settings = default_settings.copy()
-                settings.update(saved_settings)
-                return settings
-    except Exception:
-        pass
-    return default_settings.copy()
+    return SettingsStore(SETTINGS_FILE, default_settings, SETTINGS_SCHEMA, app.logger)
 
-def save_settings(settings):
-    """Save settings to file"""
-    try:
-        with open(SETTINGS_FILE, 'w') as f:
-            json.dump(settings, f, indent=2)
-    except Exception:
-        pass
+def reload_settings():
+    """Pick up settings saved by another worker process; returns True if they changed"""
+    return settings.reload()
+
+def update_settings(changes):
+    """Validate changes, apply them to the settings and save them
+
+    Raises ValueError for invalid values and OSError if the file cannot
+    be written.
+    """
+    settings.apply(changes)
 
 # Load settings on startup
 settings = load_settings()
@@ -102,7 +162,8 @@ translations = {
             'Zeigt nur Abfahrten, die Sie noch erreichen können (Gehzeit + 2min Puffer)',
             'Sortiert nach Abfahrtszeit'
         ],
-        'no_departures_available': 'Keine Abfahrten verfügbar'
+        'no_departures_available': 'Keine Abfahrten verfügbar',
+        'data_age': 'Stand vor %s Min'
     },
     'en': {
         'nearby_departures': 'Nearby Departures',
@@ -154,241 +215,870 @@ translations = {
             'Shows only departures you can still reach (walking time + 2min buffer)',
             'Sorts by departure time'
         ],
-        'no_departures_available': 'No departures available'
+        'no_departures_available': 'No departures available',
+        'data_age': 'as of %s min ago'
     }
 }
 
+# Upstream APIs; overridable to run against a local stub (see bench/)
+VBB_API_URL = os.environ.get('VBB_API_URL', 'https://v6.vbb.transport.rest')
+NOMINATIM_URL = os.environ.get('NOMINATIM_URL', 'https://nominatim.openstreetmap.org')
+
+# Departures are fetched in parallel; the board is rendered with whatever
+# has arrived once FETCH_DEADLINE (seconds) has passed.
+FETCH_WORKERS = 8
+FETCH_DEADLINE = 8
+
+fetch_executor = ThreadPoolExecutor(max_workers=FETCH_WORKERS, thread_name_prefix='departures')
+
+# All upstream calls share one keep-alive connection pool
+upstream = UpstreamClient(pool_size=FETCH_WORKERS)
+
+class TranslationTable(dict):
+    """Translations of one language; unknown keys translate to themselves"""
+
+    def __missing__(self, key):
+        return key
+
+translation_tables = {language: TranslationTable(table) for language, table in translations.items()}
+
 def t(key):
     """Translation helper function"""
-    return translations[settings['language']].get(key, key)
+    return translation_tables[settings['language']][key]
+
+@contextmanager
+def timed(stage):
+    """Time a stage for /metrics and, inside a request, for Server-Timing"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        metrics.stage_seconds.observe(elapsed, stage=stage)
+        if has_request_context():
+            g.setdefault('server_timing', []).append((stage, elapsed))
+
+# Geocoded addresses are kept next to settings.json; an address index built
+# with `python geocoding.py build` answers lookups without any network at all.
+GEOCODE_CACHE_FILE = os.path.join(os.path.dirname(SETTINGS_FILE), 'geocode_cache.json')
+ADDRESS_INDEX_FILE = os.environ.get('ADDRESS_INDEX', os.path.join(os.path.dirname(SETTINGS_FILE), 'addresses.db'))
+
+geocode_cache = GeocodeCache(GEOCODE_CACHE_FILE)
+address_index = AddressIndex.open(ADDRESS_INDEX_FILE)
 
 def get_coordinates_from_address(address):
+    """Get coordinates from address, via the geocode cache, the address index or Nominatim"""
+    key = normalize_address(address)
+    coordinates = geocode_cache.get(key)
+    if coordinates is None and address_index is not None:
+        coordinates = address_index.lookup(key)
+        if coordinates is not None:
+            geocode_cache.put(key, *coordinates)
+    if coordinates is not None:
+        metrics.cache_hits.inc(cache='geocode')
+        return coordinates
+
+    metrics.cache_misses.inc(cache='geocode')
+    lat, lon = geocode_with_nominatim(address)
+    # Misses are not cached: the next attempt may well succeed
+    if lat is not None:
+        geocode_cache.put(key, lat, lon)
+    return lat, lon
+
+def geocode_with_nominatim(address):
     """Get coordinates from address using Nominatim"""
     try:
-        url = "https://nominatim.openstreetmap.org/search"
+        url = f"{NOMINATIM_URL}/search"
         params = {
             'q': f"{address}, Berlin, Germany",
             'format': 'json',
             'limit': 1
         }
         headers = {'User-Agent': 'BVG-Departure-Board/1.0'}
-        response = requests.get(url, params=params, headers=headers, timeout=10)
+        response = upstream.get(url, params=params, headers=headers, timeout=10, endpoint='geocode')
         
         if response.status_code == 200:
             data = response.json()
             if data:
                 return float(data[0]['lat']), float(data[0]['lon'])
         return None, None
-    except Exception:
+    except CircuitOpenError:
+        return None, None
+    except Exception as e:
+        app.logger.warning("Geocoding %r failed: %s", address, e)
         return None, None
 
-def calculate_distance(lat1, lon1, lat2, lon2):
-    """Calculate distance between two coordinates in meters"""
-    R = 6371000  # Earth's radius in meters
-    
-    lat1_rad = math.radians(lat1)
-    lat2_rad = math.radians(lat2)
-    delta_lat = math.radians(lat2 - lat1)
-    delta_lon = math.radians(lon2 - lon1)
-    
-    a = (math.sin(delta_lat/2) * math.sin(delta_lat/2) +
-         math.cos(lat1_rad) * math.cos(lat2_rad) *
-         math.sin(delta_lon/2) * math.sin(delta_lon/2))
-    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
-    
-    return R * c
+# With a footways.graph built from an OSM extract (see walking.py) walking
+# times follow the actual footpaths instead of a straight line.
+WALK_GRAPH_FILE = os.environ.get('WALK_GRAPH', os.path.join(os.path.dirname(SETTINGS_FILE), 'footways.graph'))
+WALK_TIMES_FILE = os.path.join(os.path.dirname(SETTINGS_FILE), 'walk_times.json')
+
+# The graph is loaded on first use; if it cannot be read the model logs a
+# warning and falls back to straight-line times.
+walking_model = WalkingModel.open(WALK_GRAPH_FILE, WALK_TIMES_FILE, app.logger)
+
+def station_walks(lat, lon, stations):
+    """(station, straight-line distance in meters, walking minutes) of stations with a location"""
+    located = []
+    for station in stations:
+        if not isinstance(station, dict) or 'id' not in station:
+            continue
+        station_lat = station.get('location', {}).get('latitude')
+        station_lon = station.get('location', {}).get('longitude')
+        if station_lat and station_lon:
+            located.append((station, station_lat, station_lon))
+    walk_times = walking_model.walk_times(
+        lat, lon, [(station['id'], station_lat, station_lon) for station, station_lat, station_lon in located])
+    return [(station, calculate_distance(lat, lon, station_lat, station_lon), walk_times[station['id']])
+            for station, station_lat, station_lon in located]
+
+# With a GTFS stops.txt from the VBB open data feed nearby stations are
+# searched locally instead of via /locations/nearby.
+STOP_INDEX_FILE = os.environ.get('STOP_INDEX', os.path.join(os.path.dirname(SETTINGS_FILE), 'stops.txt'))
+
+def load_stop_index():
+    """Load the local stop index, None if there is no stops.txt"""
+    if not os.path.exists(STOP_INDEX_FILE):
+        return None
+    try:
+        return StopIndex.from_gtfs(STOP_INDEX_FILE)
+    except Exception as e:
+        app.logger.warning("Could not load stop index %s: %s", STOP_INDEX_FILE, e)
+        return None
+
+stop_index = load_stop_index()
 
 def find_nearby_stations(lat, lon, radius=1000):
     """Find stations near coordinates"""
+    if stop_index is not None:
+        return stop_index.nearby(lat, lon, radius)
     try:
-        url = "https://v6.vbb.transport.rest/locations/nearby"
+        url = f"{VBB_API_URL}/locations/nearby"
         params = {
             'latitude': lat,
             'longitude': lon,
             'distance': radius,
             'results': 50
         }
-        response = requests.get(url, params=params, timeout=10)
+        response = upstream.get(url, params=params, timeout=10, endpoint='nearby')
         if response.status_code == 200:
             data = response.json()
             if isinstance(data, list) and all(isinstance(item, dict) for item in data):
                 return data
         return []
+    except CircuitOpenError:
+        return []
     except Exception as e:
-        pass
+        app.logger.warning("Nearby station lookup failed: %s", e)
         return []
 
-def get_line_type(line_name, line_product=None):
-    """Determine BVG line type"""
-    if not line_name or line_name == 'N/A':
-        return 'bus'
-    
-    line_name = str(line_name).upper().replace(' ', '')
-    
-    if line_product:
-        product = str(line_product).lower()
-        if 'tram' in product:
-            return 'tram'
-        elif 'bus' in product:
-            return 'bus'
-        elif 'subway' in product or 'metro' in product:
-            return line_name.lower() if line_name.startswith('U') else 'u'
-        elif 'suburban' in product:
-            return line_name.lower() if line_name.startswith('S') else 's'
-    
-    if line_name.startswith('S'):
-        return line_name.lower()
-    elif line_name.startswith('U'):
-        return line_name.lower()
-    elif line_name.startswith(('RE', 'RB', 'IC', 'ICE')):
-        return 'regional'
+# Nearby-station lookups only change with the location or search radius, so
+# they are cached next to settings.json until the location is edited. Each
+# worker process keeps its own copy and drops it when the settings change.
+STATION_CACHE_FILE = os.path.join(os.path.dirname(SETTINGS_FILE), 'station_cache.json')
+STATION_CACHE_TTL = 24 * 60 * 60  # seconds
+
+def load_station_cache():
+    """Load the station cache from file"""
+    try:
+        if os.path.exists(STATION_CACHE_FILE):
+            with open(STATION_CACHE_FILE, 'r') as f:
+                cache = json.load(f)
+                if isinstance(cache, dict):
+                    return cache
+    except Exception:
+        pass
+    return {}
+
+def save_station_cache(cache):
+    """Save the station cache to file"""
+    try:
+        with atomic_write(STATION_CACHE_FILE) as f:
+            json.dump(cache, f)
+    except Exception:
+        pass
+
+station_cache = load_station_cache()
+station_cache_lock = threading.Lock()
+
+def get_nearby_stations(lat, lon, radius=1000, offline=False):
+    """Find stations near coordinates, served from the station cache when possible
+
+    With `offline` the upstream is not asked, even if the cache entry
+    expired or is missing.
+    """
+    if stop_index is not None:
+        # Local queries are cheaper than the cache
+        return find_nearby_stations(lat, lon, radius)
+    key = f"{lat:.6f},{lon:.6f},{radius}"
+    entry = station_cache.get(key)
+    if offline:
+        return [dict(station) for station in entry['stations']] if entry else []
+    if not entry or time.time() - entry['fetched_at'] > STATION_CACHE_TTL:
+        metrics.cache_misses.inc(cache='stations')
+        stations = find_nearby_stations(lat, lon, radius)
+        # Failed lookups come back empty: keep using an expired entry if any
+        if not stations:
+            return [dict(station) for station in entry['stations']] if entry else []
+        entry = {'fetched_at': time.time(), 'stations': stations}
+        with station_cache_lock:
+            station_cache[key] = entry
+            save_station_cache(station_cache)
     else:
-        return 'bus'
+        metrics.cache_hits.inc(cache='stations')
+    # Callers annotate the station dicts, so hand out copies
+    return [dict(station) for station in entry['stations']]
+
+def forget_station_cache():
+    """Drop this process's cached station lookups, leaving the file alone"""
+    with station_cache_lock:
+        station_cache.clear()
+
+def invalidate_station_cache():
+    """Forget all cached station lookups"""
+    with station_cache_lock:
+        station_cache.clear()
+        save_station_cache(station_cache)
+
+# Last good departures per station as (departures, fetched_at). While the
+# upstream is failing these are served instead, with their age on the board.
+departure_cache = {}
+DEPARTURE_CACHE_MAX_AGE = 2 * 60 * 60  # longer than any request window
+STALE_AFTER = 2 * 60  # seconds before cached departures are marked as old
 
-def get_station_departures(station_id, limit=30):
-    """Get departures for a station"""
+def get_station_departures(station_id, limit=30, duration=120):
+    """Get departures for a station, falling back to the last good ones"""
     try:
-        url = f"https://v6.vbb.transport.rest/stops/{station_id}/departures"
-        params = {'results': limit, 'duration': 120}
-        response = requests.get(url, params=params, timeout=10)
+        url = f"{VBB_API_URL}/stops/{station_id}/departures"
+        params = {'results': limit, 'duration': duration}
+        response = upstream.get(url, params=params, timeout=10, endpoint='departures')
         
         if response.status_code == 200:
             data = response.json()
+            departures = []
             if isinstance(data, dict) and 'departures' in data:
-                departures = data['departures']
-                return departures if isinstance(departures, list) else []
+                if isinstance(data['departures'], list):
+                    departures = data['departures']
             elif isinstance(data, list):
-                return data
-            return []
-        else:
-            pass
-        return []
-    except Exception as e:
+                departures = data
+            departure_cache[station_id] = (departures, time.time())
+            return departures
+    except CircuitOpenError:
         pass
-        return []
+    except Exception as e:
+        app.logger.warning("Departures for station %s failed: %s", station_id, e)
+    departures, fetched_at = get_cached_departures(station_id)
+    if fetched_at:
+        metrics.cache_hits.inc(cache='stale_departures')
+    return departures
 
+def get_cached_departures(station_id):
+    """Last good departures of a station and when they were fetched"""
+    entry = departure_cache.get(station_id)
+    if entry is None or time.time() - entry[1] > DEPARTURE_CACHE_MAX_AGE:
+        return [], None
+    return entry
 
-@app.route('/')
-def index():
-    """Main departure board with simple flat list"""
-    if not settings['latitude'] or not settings['longitude']:
-        return redirect(url_for('setup'))
+def fetch_departures_concurrently(station_requests, deadline=FETCH_DEADLINE):
+    """Fetch departures for several stations in parallel
+
+    `station_requests` maps station ID to the number of departures wanted
+    and the minutes ahead to ask for. Returns a dict mapping station ID to
+    (departures, fetched_at). Stations that fail or miss the deadline get
+    their last good departures; a late answer still refreshes the cache in
+    the background for the next round.
+    """
+    futures = [fetch_executor.submit(get_station_departures, station_id, limit, duration)
+               for station_id, (limit, duration) in station_requests.items()]
+    wait(futures, timeout=deadline)
+    return {station_id: get_cached_departures(station_id) for station_id in station_requests}
+
+def get_board_settings(name=None):
+    """Settings of a board profile, None if there is no such board
+
+    Profiles live under 'boards' in settings.json; keys they leave out are
+    taken from the main settings. The main board (name None) uses the main
+    settings as they are.
+    """
+    if name is None:
+        return settings
+    profile = settings.get('boards', {}).get(name)
+    if not isinstance(profile, dict):
+        return None
+    board = dict(settings)
+    board.update({key: profile[key] for key in BOARD_KEYS if key in profile})
+    # A profile with its own address must not borrow the main coordinates
+    if 'address' in profile and not ('latitude' in profile and 'longitude' in profile):
+        board['latitude'] = board['longitude'] = None
+    return board
+
+# Board profiles whose address could not be geocoded: name -> (address,
+# monotonic time of the next attempt, seconds to wait after that one fails)
+BOARD_GEOCODE_RETRY = 60  # seconds
+BOARD_GEOCODE_RETRY_MAX = 60 * 60
+board_geocode_failures = {}
+board_geocode_lock = threading.Lock()
+
+def locate_board(name, board, offline=False):
+    """Geocode a board profile that only has an address
+
+    An address that cannot be geocoded is tried again after a backoff
+    that doubles with every failure, not on every round and request.
+    """
+    if board['latitude'] and board['longitude'] or not board.get('address') or offline:
+        return board
+    address = board['address']
+    with board_geocode_lock:
+        failure = board_geocode_failures.get(name)
+        if failure is not None and failure[0] == address and time.monotonic() < failure[1]:
+            return board
+    with timed('geocode'):
+        lat, lon = get_coordinates_from_address(address)
+    with board_geocode_lock:
+        if lat and lon:
+            board_geocode_failures.pop(name, None)
+        else:
+            backoff = failure[2] if failure is not None and failure[0] == address else BOARD_GEOCODE_RETRY
+            board_geocode_failures[name] = (address, time.monotonic() + backoff,
+                                            min(backoff * 2, BOARD_GEOCODE_RETRY_MAX))
+            app.logger.warning("Could not geocode board %s (%r), trying again in %d s", name, address, backoff)
+    if lat and lon and name in settings['boards']:
+        board['latitude'], board['longitude'] = lat, lon
+        boards = dict(settings['boards'])
+        boards[name] = dict(boards[name], latitude=lat, longitude=lon)
+        try:
+            update_settings({'boards': boards})
+        except OSError as e:
+            app.logger.warning("Could not save the location of board %s: %s", name, e)
+    return board
+
+def find_reachable_stations(board, offline=False):
+    """Stations of a board within walking distance, with their walk time"""
+    search_radius = board['max_walk_minutes'] * 80
+    with timed('stations'):
+        stations = get_nearby_stations(board['latitude'], board['longitude'], search_radius, offline)
     
-    try:
-        search_radius = settings['max_walk_minutes'] * 80
-        stations = find_nearby_stations(settings['latitude'], settings['longitude'], search_radius)
-        all_departures = []
-        
-        for station in stations:
-            if not isinstance(station, dict) or 'id' not in station:
-                continue
-            if settings['selected_stations'] and station['id'] not in settings['selected_stations']:
-                continue
-            station_lat = station.get('location', {}).get('latitude')
-            station_lon = station.get('location', {}).get('longitude')
-            
-            if station_lat and station_lon:
-                distance = calculate_distance(
-                    settings['latitude'], settings['longitude'],
-                    station_lat, station_lon
-                )
-                
-                actual_walking_distance = distance * 1.3
-                walk_time = int(actual_walking_distance / 80)
-                
-                if walk_time <= settings['max_walk_minutes']:
-                    departures = get_station_departures(station['id'], settings['max_departures_per_station'])
-                    
-                    # Group departures by line and direction to get next 3 times
-                    line_direction_groups = defaultdict(list)
-                    
-                    for dep in departures:
-                        if dep.get('when'):
-                            try:
-                                dep_time = datetime.fromisoformat(dep['when'].replace('Z', '+00:00'))
-                                now = datetime.now(dep_time.tzinfo)
-                                minutes_until = int((dep_time - now).total_seconds() / 60)
-                                
-                                time_ok = settings['min_minutes'] <= minutes_until <= settings['max_minutes']
-                                reachable = minutes_until >= walk_time
-                                
-                                if time_ok and reachable:
-                                    line_name = dep.get('line', {}).get('name', 'N/A')
-                                    direction = dep.get('direction', 'N/A')
-                                    
-                                    # Calculate delay
-                                    delay = 0
-                                    if dep.get('delay'):
-                                        delay = int(dep['delay'] / 60)  # Convert seconds to minutes
-                                    
-                                    # Adjust minutes_until for delay
-                                    actual_minutes_until = minutes_until + delay
-                                    
-                                    key = f"{line_name}|{direction}"
-                                    line_direction_groups[key].append({
-                                        'minutes_until': actual_minutes_until,
-                                        'delay': delay,
-                                        'platform': dep.get('platform') or '',
-                                        'line_product': dep.get('line', {}).get('product', None)
-                                    })
-                            except Exception:
-                                pass
-                    
-                    # Process grouped departures
-                    for key, group_deps in line_direction_groups.items():
-                        if not group_deps:
-                            continue
-                            
-                        line_name, direction = key.split('|', 1)
-                        
-                        # Sort by departure time and take first 3
-                        group_deps.sort(key=lambda x: x['minutes_until'])
-                        next_deps = group_deps[:3]
-                        
-                        first_dep = next_deps[0]
-                        leave_in_minutes = first_dep['minutes_until'] - walk_time
-                        leave_time = f"{leave_in_minutes} {t('min')}" if leave_in_minutes > 0 else t('now')
-                        
-                        # Determine urgency
-                        if leave_in_minutes <= 0:
-                            urgency = 'now'
-                        elif leave_in_minutes <= 3:
-                            urgency = 'soon'
-                        else:
-                            urgency = 'later'
-                        
-                        # Format display time
-                        display_time = f"{first_dep['minutes_until']} {t('min')}" if first_dep['minutes_until'] <= 10 else f"{first_dep['minutes_until']} {t('min')}"
-                        
-                        # Format next times
-                        next_times = ""
-                        if len(next_deps) > 1:
-                            next_times = ", ".join([f"{dep['minutes_until']}{t('min')}" for dep in next_deps[1:]])
-                        
-                        all_departures.append({
-                            'station_name': station['name'],
-                            'line': line_name,
-                            'line_type': get_line_type(line_name, first_dep['line_product']),
-                            'direction': direction,
-                            'minutes': display_time,
-                            'next_times': next_times,
-                            'platform': first_dep['platform'],
-                            'leave_time': leave_time,
-                            'urgency': urgency,
-                            'leave_in_minutes': leave_in_minutes,
-                            'delay': first_dep['delay'] if first_dep['delay'] > 0 else None
-                        })
+    if board['selected_stations']:
+        stations = [station for station in stations
+                    if isinstance(station, dict) and station.get('id') in board['selected_stations']]
+    
+    reachable_stations = []
+    for station, distance, walk_time in station_walks(board['latitude'], board['longitude'], stations):
+        if walk_time <= board['max_walk_minutes']:
+            reachable_stations.append((station, walk_time))
+    return reachable_stations
+
+# Departures of every shown station, merged fetch by fetch. Only touched by
+# build_departure_boards, which the poller never runs concurrently.
+station_states = {}
+scheduler = PollScheduler()
+
+DELAY_LOG_FILE = os.path.join(os.path.dirname(SETTINGS_FILE), 'delays.bin')
+
+delay_recorder = DelayRecorder(DELAY_LOG_FILE)
+# Records still in memory are written when the process exits
+atexit.register(delay_recorder.flush)
+
+def record_delay(station_id, dep):
+    """Remember the last known delay of a departure that has left"""
+    if dep.delay_seconds is None:
+        return  # no realtime data: the delay is unknown, not zero
+    scheduled = dep.planned if dep.planned is not None else dep.timestamp - dep.delay_seconds
+    delay_recorder.record(station_id, dep.line_name, dep.direction, scheduled, dep.delay_seconds)
+    metrics.delays_recorded.inc()
+
+def build_departure_boards(offline=False):
+    """Fetch and process departures for the main board and all board profiles
+
+    A station shown on several boards is fetched and parsed only once per
+    round. Returns a dict mapping board name (None for the main board) to
+    its rows. Rows are language neutral; labels are added when rendering.
+
+    With `offline` nothing is fetched: the boards are built from the
+    stations and departures kept on disk, every row marked with its age.
+    """
+    # A board that fails is left out of the round; the others are built
+    boards = {None: settings}
+    for name in settings.get('boards', {}):
+        try:
+            board = get_board_settings(name)
+            if board is not None:
+                boards[name] = locate_board(name, board, offline)
+        except Exception:
+            app.logger.exception("Preparing board %s failed", name)
+    
+    # Collect reachable stations of every board first so that all their
+    # departures can be fetched in parallel. A station on several boards is
+    # polled for the most demanding of them: (walk_time, min_minutes,
+    # max_minutes, limit).
+    plans = {}
+    station_params = {}
+    for name, board in list(boards.items()):
+        if not board['latitude'] or not board['longitude']:
+            plans[name] = []
+            continue
+        try:
+            plans[name] = find_reachable_stations(board, offline)
+        except Exception:
+            app.logger.exception("Finding the stations of board %s failed", name or 'main')
+            del boards[name]
+            continue
+        for station, walk_time in plans[name]:
+            params = (walk_time, board['min_minutes'], board['max_minutes'], board['max_departures_per_station'])
+            current = station_params.get(station['id'], params)
+            station_params[station['id']] = (min(current[0], params[0]), min(current[1], params[1]),
+                                             max(current[2], params[2]), max(current[3], params[3]))
+    
+    # Only stations whose departures may have become outdated are fetched
+    base_interval = settings.get('poll_interval', 30)
+    poll_started = time.time()
+    station_requests = {}
+    if not offline:
+        for station_id, params in station_params.items():
+            if scheduler.is_due(station_id, params, poll_started, base_interval):
+                station_requests[station_id] = (params[3], scheduler.window(params[2]))
+        metrics.station_polls.inc(len(station_requests), outcome='fetched')
+        metrics.station_polls.inc(len(station_params) - len(station_requests), outcome='skipped')
         
-        # Sort all departures by urgency (most urgent first)
-        all_departures.sort(key=lambda x: x['leave_in_minutes'] if x['leave_in_minutes'] > 0 else -1)
+        with timed('fetch'):
+            fetch_departures_concurrently(station_requests)
+        # Kept in the shared store so that a new leader can fall back on them
+        snapshot_store.save_departures({station_id: departure_cache[station_id]
+                                        for station_id in station_requests if station_id in departure_cache})
+    
+    with timed('process'):
+        now = datetime.now(timezone.utc)
+        merged = {}
+        for station_id, params in station_params.items():
+            departures, fetched_at = get_cached_departures(station_id)
+            state = station_states.get(station_id)
+            if state is None:
+                state = station_states[station_id] = StationState(partial(record_delay, station_id))
+            on_departed = state.on_departed
+            if offline:
+                # Departures restored from disk may be hours old: their
+                # delays are not worth recording, and the station is due
+                # for a fetch right away
+                state.on_departed = None
+            # Unchanged cache entries (skipped or failed fetches) need no merging
+            if fetched_at != state.fetched_at:
+                state.merge(departures, fetched_at)
+                if not offline:
+                    scheduler.schedule(station_id, params, state, poll_started, base_interval)
+            state.evict(now)
+            state.on_departed = on_departed
+            # Departures count as old once their refresh is overdue
+            age = None
+            if fetched_at and offline:
+                age = max(1, math.ceil((now.timestamp() - fetched_at) / 60))
+            elif fetched_at:
+                overdue = now.timestamp() - fetched_at - scheduler.interval(station_id, base_interval)
+                if overdue > STALE_AFTER:
+                    age = int((now.timestamp() - fetched_at) / 60)
+            merged[station_id] = (state, age)
+        # Forget stations that are on no board anymore
+        for station_id in [station_id for station_id in station_states if station_id not in station_params]:
+            del station_states[station_id]
+        scheduler.forget(station_params)
         
-        return render_template('nearby_departures.html', 
-                             departures=all_departures, 
-                             settings=settings, t=t)
+        results = {}
+        for name, board in boards.items():
+            try:
+                results[name] = process_board(
+                    ((station, walk_time) + merged[station['id']] for station, walk_time in plans[name]),
+                    board['min_minutes'], board['max_minutes'], now
+                )
+            except Exception:
+                app.logger.exception("Processing board %s failed", name or 'main')
+        return results
+
+# Files shared by the worker processes of one installation
+STATE_DB_FILE = os.path.join(os.path.dirname(SETTINGS_FILE), 'state.db')
+POLLER_LOCK_FILE = os.path.join(os.path.dirname(SETTINGS_FILE), 'poller.lock')
+SYNC_INTERVAL = 1  # seconds between checks for new snapshots and settings
+METRICS_INTERVAL = 5  # seconds between publishing the metrics of a worker
+METRICS_MAX_AGE = 60  # seconds before the metrics of a worker that stopped publishing are dropped
+
+snapshot_store = SnapshotStore(STATE_DB_FILE)
+
+class DeparturePoller:
+    """Background thread keeping versioned snapshots of the departure boards
+
+    Every round builds all boards at once; their snapshots share a version.
+    With several worker processes only the leader, the one holding the
+    poller lock, builds boards. It publishes them to the shared store and
+    the other workers pick them up from there.
+
+    After a restart the leader first builds the boards from the departures
+    kept on disk, without any upstream call, so there is something to show
+    while the first fetch is still running.
+    """
+    
+    def __init__(self, build, store=None, leader_lock=None):
+        self._build = build
+        self._store = store
+        self._leader_lock = leader_lock
+        self._lock = threading.Lock()
+        self._updated = threading.Condition(self._lock)
+        self._poll_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._generation = 0
+        self.is_leader = leader_lock is None
+        # Versions start at the boot time so they stay unique across restarts
+        self.version = int(time.time())
+        self.snapshots = None
+        # Followers: the last published version that is known to be outdated
+        self._discarded = 0
+        # Seconds from process start to the first restored and fresh board
+        self.ready_after = {}
+        self._metrics_published = 0.0
+    
+    @property
+    def snapshot(self):
+        """Latest snapshot of the main board"""
+        snapshots = self.snapshots
+        return snapshots.get(None) if snapshots else None
+    
+    def start(self):
+        """Start the polling thread if it is not running yet"""
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._try_lead()
+                self._thread = threading.Thread(target=self._run, name='departure-poller', daemon=True)
+                self._thread.start()
+    
+    def _try_lead(self):
+        """Become the leader if no other process is"""
+        if self.is_leader or not self._leader_lock.acquire(blocking=False):
+            return
+        self.is_leader = True
+        if self._store is not None:
+            # Continue after the versions of the previous leader
+            self.version = max(self.version, self._store.version() or 0)
+            restored = self._store.load_departures(DEPARTURE_CACHE_MAX_AGE, time.time())
+            for station_id, entry in restored.items():
+                if station_id not in departure_cache or departure_cache[station_id][1] < entry[1]:
+                    departure_cache[station_id] = entry
+        app.logger.info("Process %s is polling the departures", os.getpid())
+    
+    def poll_now(self):
+        """Rebuild the boards and publish them as new snapshots"""
+        with self._poll_lock:
+            return self._poll()
+    
+    def warm_up(self):
+        """Build the boards from the departures kept on disk, if there are any"""
+        if self.snapshots or not departure_cache:
+            return
+        try:
+            with self._poll_lock:
+                self._poll(offline=True)
+        except Exception:
+            app.logger.exception("Restoring the departure boards failed")
+    
+    def _ready(self, kind):
+        """Log how long it took until the first board of a kind could be served"""
+        if kind not in self.ready_after:
+            self.ready_after[kind] = time.monotonic() - STARTED
+            app.logger.info("First %s departure board ready %.2f s after start", kind, self.ready_after[kind])
+    
+    def get_snapshot(self, board=None):
+        """Return the latest snapshot of a board, building one first if there is none"""
+        snapshots = self.snapshots
+        if not snapshots:
+            # Wait for the poller thread or the leader, which may be fetching
+            # right now; a board restored from disk is usually there at once
+            self.sync()
+            self.wait_for_update(self._discarded, board, FETCH_DEADLINE + 2 * SYNC_INTERVAL)
+            snapshots = self.snapshots
+        while not snapshots or board not in snapshots:
+            with self._poll_lock:
+                # Another thread may have finished a poll while we waited
+                snapshots = self.snapshots
+                if not snapshots or board not in snapshots:
+                    snapshots = self._poll()
+                    if snapshots is not None and board not in snapshots:
+                        return None
+        return snapshots[board]
+    
+    def _poll(self, offline=False):
+        generation = self._generation
+        started = time.time()
+        boards = self._build(offline=True) if offline else self._build()
+        with self._lock:
+            # Settings changed while fetching: the result is already outdated
+            if generation != self._generation:
+                return self.snapshots
+            # A follower building for itself keeps the leader's version
+            if self.is_leader:
+                self.version += 1
+            updated = time.time()
+            snapshots = {}
+            for name, departures in boards.items():
+                # Serialised once per snapshot for the JSON API; the ETag only
+                # depends on the content, so an unchanged board keeps its ETag.
+                body = json.dumps([row.as_dict() for row in departures], separators=(',', ':'))
+                snapshots[name] = self._snapshot(updated, departures, body, hashlib.sha1(body.encode()).hexdigest())
+            self.snapshots = snapshots
+            self._updated.notify_all()
+        if offline:
+            self._ready('restored')
+        elif any(fetched_at >= started for _, fetched_at in list(departure_cache.values())):
+            # Not after a round whose fetches all failed: it only shows the restored departures
+            self._ready('fresh')
+        if self.is_leader and self._store is not None:
+            self._store.publish(self.version, updated,
+                                {name: (snapshot['json'], snapshot['etag']) for name, snapshot in snapshots.items()})
+        return snapshots
+    
+    def _snapshot(self, updated, departures, body, etag):
+        return {
+            'version': self.version,
+            'updated': updated,
+            'departures': departures,
+            'json': body,
+            'etag': etag
+        }
+    
+    def sync(self):
+        """Pick up snapshots the leader published since our last ones"""
+        if self._store is None or self.is_leader:
+            return
+        version = self._store.version()
+        if version is None or version <= self._known_version():
+            return
+        loaded = self._store.load()
+        if loaded is None:
+            return
+        version, updated, boards = loaded
+        if self.snapshots is None and time.time() - updated > 3 * settings.get('poll_interval', 30) + FETCH_DEADLINE:
+            return  # left from before a restart; the leader is about to publish newer ones
+        with self._lock:
+            if version <= self._known_version():
+                return
+            self.version = version
+            self.snapshots = {
+                name: self._snapshot(updated, [BoardRow(**row) for row in json.loads(body)], body, etag)
+                for name, (body, etag) in boards.items()
+            }
+            self._updated.notify_all()
+        self._ready('shared')
+    
+    def _known_version(self):
+        return self.version if self.snapshots is not None else self._discarded
+    
+    def wait_for_update(self, version, board=None, timeout=None):
+        """Wait until a snapshot newer than version is published and return it"""
+        with self._updated:
+            self._updated.wait_for(
+                lambda: self.snapshots is not None and self.version > version,
+                timeout
+            )
+            return self.snapshots.get(board) if self.snapshots else None
+    
+    def invalidate(self):
+        """Drop the current snapshots and refresh as soon as possible"""
+        with self._lock:
+            self._generation += 1
+            if self.snapshots is not None:
+                self._discarded = self.version
+            self.snapshots = None
+        self._wakeup.set()
+    
+    def publish_metrics(self):
+        """Share this process's metrics with the other workers every METRICS_INTERVAL seconds"""
+        now = time.time()
+        if self._store is None or now - self._metrics_published < METRICS_INTERVAL:
+            return
+        self._metrics_published = now
+        self._store.save_metrics(os.getpid(), now, metrics.REGISTRY.state())
+
+    def _idle(self, seconds):
+        """Sleep until the next round, following settings and snapshots of other workers"""
+        deadline = time.monotonic() + seconds
+        while not self._wakeup.is_set():
+            try:
+                if reload_settings():
+                    # The worker that saved them cleared the station cache file
+                    forget_station_cache()
+                    self.invalidate()
+                self.sync()
+                self.publish_metrics()
+                delay_recorder.flush_if_due()
+            except Exception:
+                app.logger.exception("Syncing with the other workers failed")
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            self._wakeup.wait(min(SYNC_INTERVAL, remaining))
+        self._wakeup.clear()
+    
+    def _run(self):
+        self._try_lead()
+        if self.is_leader:
+            self.warm_up()
+        while True:
+            self._try_lead()
+            if self.is_leader:
+                try:
+                    self.poll_now()
+                except Exception:
+                    app.logger.exception("Refreshing the departure boards failed")
+                self._idle(settings.get('poll_interval', 30))
+            else:
+                self._idle(SYNC_INTERVAL)
+
+poller = DeparturePoller(build_departure_boards, snapshot_store, ProcessLock(POLLER_LOCK_FILE))
+
+def diff_departures(old_rows, new_rows):
+    """Describe how to turn one list of board rows into another
+
+    Only rows that are new or changed are included; `order` is sent when
+    the sequence of rows changed.
+    """
+    old_by_id = {row.id: row for row in old_rows}
+    new_ids = [row.id for row in new_rows]
+    new_id_set = set(new_ids)
+    
+    diff = {}
+    upsert = [row.as_dict() for row in new_rows if old_by_id.get(row.id) != row]
+    if upsert:
+        diff['upsert'] = upsert
+    remove = [row_id for row_id in old_by_id if row_id not in new_id_set]
+    if remove:
+        diff['remove'] = remove
+    if [row_id for row_id in old_by_id if row_id in new_id_set] != new_ids:
+        diff['order'] = new_ids
+    return diff
+
+def sse_event(event, data, event_id=None):
+    """Format one Server-Sent Event"""
+    message = f"event: {event}\n"
+    if event_id is not None:
+        message += f"id: {event_id}\n"
+    return message + f"data: {json.dumps(data, separators=(',', ':'))}\n\n"
+
+SSE_KEEPALIVE = 15  # seconds
+# Every open stream holds a server thread; see gunicorn.conf.py
+MAX_STREAMS = int(os.environ.get('MAX_STREAMS', 24))
+open_streams = 0
+open_streams_lock = threading.Lock()
+
+@lru_cache(maxsize=2048)
+def render_row(content, language, show_platform):
+    """HTML of one board row with the content given by BoardRow.content_key()"""
+    dep = dict(zip(BoardRow.__slots__, content))
+    return app.jinja_env.get_template('departure_row.html').render(
+        dep=dep, tr=translation_tables[language], show_platform=show_platform)
+
+def render_rows(rows, language, show_platform):
+    """HTML of the board rows, each row rendered only once per content and language"""
+    return Markup(''.join(render_row(row.content_key(), language, show_platform) for row in rows))
+
+@lru_cache(maxsize=None)
+def asset_version(filename):
+    """Short content hash of a static file"""
+    with open(os.path.join(app.static_folder, filename), 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()[:10]
+
+@app.template_global()
+def asset_url(filename):
+    """URL of a static file that changes with its content, so it can be cached for good"""
+    return url_for('static', filename=filename, v=asset_version(filename))
+
+def render_board(name=None):
+    """Render the departure board of the main settings or a board profile"""
+    board = get_board_settings(name)
+    if board is None:
+        return f"<h2>Unknown board: {escape(name)}</h2><a href='/'>Back</a>", 404
+    
+    try:
+        if name is not None:
+            board = locate_board(name, board)
+        if not board['latitude'] or not board['longitude']:
+            if name is None:
+                return redirect(url_for('setup'))
+            return f"<h2>Board {escape(name)} has no location</h2><a href='/'>Back</a>", 404
+        poller.start()
+        with timed('snapshot'):
+            snapshot = poller.get_snapshot(name)
+        with timed('render'):
+            language = board['language']
+            return render_template('nearby_departures.html', 
+                                 departures=snapshot['departures'], 
+                                 rows_html=render_rows(snapshot['departures'], language, board['show_platform']),
+                                 version=snapshot['version'],
+                                 board=name,
+                                 settings=board, tr=translation_tables[language])
         
     except Exception as e:
+        app.logger.exception("Rendering the departure board failed")
         return f"<h2>Error: {e}</h2><a href='/setup'>Setup</a>"
 
+@app.route('/')
+def index():
+    """Main departure board with simple flat list"""
+    return render_board()
+
+@app.route('/board/<name>')
+def board_view(name):
+    """Departure board of a named board profile"""
+    return render_board(name)
+
+@app.route('/stream')
+def stream():
+    """Push board changes as Server-Sent Events"""
+    board = request.args.get('board') or None
+    if get_board_settings(board) is None:
+        return jsonify({'error': 'unknown board'}), 404
+    poller.start()
+    # The page passes the snapshot it was rendered from; a reconnecting
+    # EventSource sends the last event ID it saw instead.
+    try:
+        client_version = int(request.headers.get('Last-Event-ID') or request.args.get('v', 0))
+    except ValueError:
+        client_version = 0
+    
+    global open_streams
+    with open_streams_lock:
+        if open_streams >= MAX_STREAMS:
+            return jsonify({'error': 'too many open streams'}), 503, {'Retry-After': '30'}
+        open_streams += 1
+    
+    def release():
+        global open_streams
+        with open_streams_lock:
+            open_streams -= 1
+    
+    def events():
+        yield "retry: 5000\n\n"
+        snapshot = poller.get_snapshot(board)
+        rows = snapshot['departures'] if snapshot else []
+        version = snapshot['version'] if snapshot else 0
+        if version != client_version:
+            # We don't know which rows the client has, so send everything
+            yield sse_event('departures', {'reset': True, 'upsert': [row.as_dict() for row in rows]}, version)
+        
+        while True:
+            snapshot = poller.wait_for_update(version, board, SSE_KEEPALIVE)
+            if snapshot is None or snapshot['version'] <= version:
+                yield ": keepalive\n\n"
+                continue
+            diff = diff_departures(rows, snapshot['departures'])
+            rows = snapshot['departures']
+            version = snapshot['version']
+            # Sent even when empty so the page knows the board is current
+            yield sse_event('departures', diff, version)
+    
+    response = Response(events(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+    # Also called if the generator never started
+    response.call_on_close(release)
+    return response
+
 @app.route('/setup')
 def setup():
     """Setup page for address input"""
@@ -402,21 +1092,23 @@ def debug_stations():
     
     try:
         search_radius = settings['max_walk_minutes'] * 80
-        stations = find_nearby_stations(settings['latitude'], settings['longitude'], search_radius)
+        stations = get_nearby_stations(settings['latitude'], settings['longitude'], search_radius)
         
         result = f"<h2>Debug Info</h2>"
         result += f"<p>Coordinates: {settings['latitude']}, {settings['longitude']}</p>"
         result += f"<p>Search radius: {search_radius}m</p>"
         result += f"<p>Found {len(stations)} stations:</p><ul>"
         
-        for station in stations[:10]:
-            station_lat = station.get('location', {}).get('latitude')
-            station_lon = station.get('location', {}).get('longitude')
-            if station_lat and station_lon:
-                distance = calculate_distance(settings['latitude'], settings['longitude'], station_lat, station_lon)
-                walk_time = int(distance / 80)
-                result += f"<li>{station['name']} - {int(distance)}m ({walk_time}min walk)</li>"
+        for station, distance, walk_time in station_walks(settings['latitude'], settings['longitude'], stations[:10]):
+            result += f"<li>{station['name']} - {int(distance)}m ({walk_time}min walk)</li>"
         
+        result += "</ul>"
+        
+        result += "<p>Upstream connection pool:</p><ul>"
+        for host, stats in upstream.pool_stats().items():
+            result += f"<li>{host} - {stats['requests']} requests, {stats['pool_hits']} pool hits, {stats['pool_misses']} pool misses</li>"
+        for endpoint, state in upstream.breaker_states().items():
+            result += f"<li>{endpoint} - circuit {state}</li>"
         result += "</ul><a href='/'>Back</a>"
         return result
     except Exception as e:
@@ -429,19 +1121,12 @@ def select_stations():
         return redirect(url_for('setup'))
     
     search_radius = settings['max_walk_minutes'] * 80
-    stations = find_nearby_stations(settings['latitude'], settings['longitude'], search_radius)
+    stations = get_nearby_stations(settings['latitude'], settings['longitude'], search_radius)
     
     # Add distance info to stations
-    for station in stations:
-        if not isinstance(station, dict):
-            continue
-        station_lat = station.get('location', {}).get('latitude')
-        station_lon = station.get('location', {}).get('longitude')
-        if station_lat and station_lon:
-            distance = calculate_distance(settings['latitude'], settings['longitude'], station_lat, station_lon)
-            actual_walking_distance = distance * 1.3
-            station['walk_time'] = int(actual_walking_distance / 80)
-            station['distance'] = int(distance)
+    for station, distance, walk_time in station_walks(settings['latitude'], settings['longitude'], stations):
+        station['walk_time'] = walk_time
+        station['distance'] = int(distance)
     
     stations = [s for s in stations if s.get('walk_time', 999) <= settings['max_walk_minutes']]
     stations.sort(key=lambda x: x.get('walk_time', 999))
@@ -455,52 +1140,138 @@ def api_nearby_stations():
         return jsonify([])
     
     search_radius = settings['max_walk_minutes'] * 80
-    stations = find_nearby_stations(settings['latitude'], settings['longitude'], search_radius)
+    stations = get_nearby_stations(settings['latitude'], settings['longitude'], search_radius)
     
-    for station in stations:
-        if not isinstance(station, dict):
-            continue
-        station_lat = station.get('location', {}).get('latitude')
-        station_lon = station.get('location', {}).get('longitude')
-        if station_lat and station_lon:
-            distance = calculate_distance(settings['latitude'], settings['longitude'], station_lat, station_lon)
-            actual_walking_distance = distance * 1.3
-            station['walk_time'] = int(actual_walking_distance / 80)
-            station['distance'] = int(distance)
+    for station, distance, walk_time in station_walks(settings['latitude'], settings['longitude'], stations):
+        station['walk_time'] = walk_time
+        station['distance'] = int(distance)
     
     stations = [s for s in stations if s.get('walk_time', 999) <= settings['max_walk_minutes']]
     stations.sort(key=lambda x: x.get('walk_time', 999))
     
     return jsonify(stations)
 
+@app.route('/api/departures')
+def api_departures():
+    """API endpoint for the processed departure board"""
+    board_name = request.args.get('board') or None
+    board = get_board_settings(board_name)
+    if board is None:
+        return jsonify({'error': 'unknown board'}), 404
+    if not board['latitude'] or not board['longitude']:
+        return jsonify([])
+    
+    poller.start()
+    snapshot = poller.get_snapshot(board_name)
+    response = Response(snapshot['json'], mimetype='application/json')
+    response.set_etag(snapshot['etag'])
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
+
+@app.route('/api/delays')
+def api_delays():
+    """Delay percentiles per line and direction over the last days"""
+    try:
+        days = float(request.args.get('days', 7))
+    except ValueError:
+        days = None
+    if days is None or not math.isfinite(days) or days <= 0:
+        return jsonify({'error': 'days must be a positive number'}), 400
+    since = time.time() - days * 24 * 60 * 60
+    lines = delay_recorder.percentiles(since, request.args.get('station') or None,
+                                       request.args.get('line') or None)
+    return jsonify({'days': days, 'lines': lines})
+
+def collect_upstream_metrics():
+    """Export connection pool, circuit breaker and snapshot state"""
+    pool = upstream.pool_stats()
+    yield ('departure_board_upstream_pool_hits_total', 'counter',
+           'Upstream requests served on a reused connection',
+           [({'host': host}, stats['pool_hits']) for host, stats in pool.items()])
+    yield ('departure_board_upstream_pool_misses_total', 'counter',
+           'Upstream requests that opened a new connection',
+           [({'host': host}, stats['pool_misses']) for host, stats in pool.items()])
+    yield ('departure_board_circuit_open', 'gauge',
+           'Whether the circuit breaker of an upstream endpoint is open (1) or closed (0)',
+           [({'endpoint': endpoint}, 0 if state == 'closed' else 1)
+            for endpoint, state in upstream.breaker_states().items()])
+    snapshot = poller.snapshot
+    if snapshot is not None:
+        yield ('departure_board_snapshot_age_seconds', 'gauge',
+               'Seconds since the departure board was last refreshed',
+               [({}, time.time() - snapshot['updated'])])
+    yield ('departure_board_startup_seconds', 'gauge',
+           'Seconds from process start until the first board of a kind (restored, fresh, shared) was ready',
+           [({'kind': kind}, seconds) for kind, seconds in poller.ready_after.items()])
+
+metrics.REGISTRY.add_collector(collect_upstream_metrics)
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus metrics, added up over all worker processes"""
+    try:
+        shared = snapshot_store.load_metrics(time.time() - METRICS_MAX_AGE, exclude=os.getpid())
+    except Exception as e:
+        app.logger.warning("Could not read the metrics of the other workers: %s", e)
+        shared = []
+    return Response(metrics.REGISTRY.render(shared), mimetype='text/plain; version=0.0.4')
+
+ASSET_MAX_AGE = 365 * 24 * 60 * 60  # seconds
+
+@app.after_request
+def cache_static_assets(response):
+    """Let browsers keep versioned static files without revalidating"""
+    if request.endpoint == 'static' and request.args.get('v') and response.status_code == 200:
+        response.cache_control.public = True
+        response.cache_control.max_age = ASSET_MAX_AGE
+        response.cache_control.immutable = True
+        response.cache_control.no_cache = None
+    return response
+
+@app.after_request
+def add_server_timing(response):
+    """Report the stages timed during this request"""
+    if settings.get('server_timing'):
+        timings = g.get('server_timing')
+        if timings:
+            response.headers['Server-Timing'] = ', '.join(
+                f"{stage};dur={elapsed * 1000:.1f}" for stage, elapsed in timings
+            )
+    return response
+
 @app.route('/set_language/<lang>')
 def set_language(lang):
     """Set specific language"""
-    if lang in ['de', 'en']:
-        settings['language'] = lang
-        save_settings(settings)
-    return redirect(request.referrer or url_for('index'))
+    try:
+        if lang in ['de', 'en']:
+            update_settings({'language': lang})
+        return redirect(request.referrer or url_for('index'))
+    except Exception as e:
+        return redirect(url_for('setup') + f'?error={e}')
 
 @app.route('/update_stations', methods=['POST'])
 def update_stations():
     """Update selected stations"""
-    settings['selected_stations'] = request.form.getlist('selected_stations')
-    save_settings(settings)
-    return redirect(url_for('index'))
+    try:
+        update_settings({'selected_stations': request.form.getlist('selected_stations')})
+        poller.invalidate()
+        return redirect(url_for('index'))
+    except Exception as e:
+        return redirect(url_for('setup2') + f'?error={e}')
 
 @app.route('/set_address', methods=['POST'])
 def set_address():
     """Step 1: Set address only"""
     try:
         address = request.form.get('address', '')
-        settings['address'] = address
         
         if address:
-            lat, lon = get_coordinates_from_address(address)
+            with timed('geocode'):
+                lat, lon = get_coordinates_from_address(address)
             if lat and lon:
-                settings['latitude'] = lat
-                settings['longitude'] = lon
-                save_settings(settings)
+                update_settings({'address': address, 'latitude': lat, 'longitude': lon})
+                invalidate_station_cache()
+                poller.invalidate()
                 return redirect(url_for('setup2'))
             else:
                 return redirect(url_for('setup') + '?error=address_not_found')
@@ -520,16 +1291,20 @@ def setup2():
 def update_location():
     """Update location settings and parameters"""
     try:
-        settings['max_walk_minutes'] = int(request.form.get('max_walk_minutes', 8))
-        settings['max_departures_per_station'] = int(request.form.get('max_departures_per_station', 5))
-        settings['min_minutes'] = int(request.form.get('min_minutes', 2))
-        settings['max_minutes'] = int(request.form.get('max_minutes', 30))
-        settings['show_platform'] = 'show_platform' in request.form
-        
-        save_settings(settings)
+        update_settings({
+            'max_walk_minutes': int(request.form.get('max_walk_minutes', 8)),
+            'max_departures_per_station': int(request.form.get('max_departures_per_station', 5)),
+            'min_minutes': int(request.form.get('min_minutes', 2)),
+            'max_minutes': int(request.form.get('max_minutes', 30)),
+            'show_platform': 'show_platform' in request.form
+        })
+        invalidate_station_cache()
+        poller.invalidate()
         return redirect(url_for('setup2') + '?success=1')
     except Exception as e:
         return redirect(url_for('setup2') + f'?error={e}')
 
 if __name__ == '__main__':
+    # Development server; see wsgi.py for running under gunicorn
+    poller.start()
     app.run(debug=False, host='0.0.0.0', port=5001)
@@ -0,0 +1,75 @@
+"""Per-station poll intervals for the departure fetches
+
+A station is polled every round only while someone has to leave for one
+of its departures soon. The further away the next reachable departure,
+the longer its data can rest, up to MAX_INTERVAL. Stations are always
+polled again before the departures they returned run out of the board's
+window.
+"""
+import math
+import threading
+
+MAX_INTERVAL = 300  # seconds
+IDLE_INTERVAL = 120  # seconds, for stations without a known departure ahead
+URGENT_LEAD = 3  # minutes; rows shown as 'now' or 'soon' are refreshed every round
+LEAD_SHARE = 2  # poll again halfway to the time to leave for the next departure
+
+class PollScheduler:
+    """Decide which stations to fetch in a poll round, and how far ahead"""
+
+    def __init__(self, max_interval=MAX_INTERVAL, idle_interval=IDLE_INTERVAL):
+        self.max_interval = max_interval
+        self.idle_interval = idle_interval
+        self._lock = threading.Lock()
+        # station ID -> (next poll timestamp, interval, board parameters)
+        self._stations = {}
+
+    def window(self, max_minutes):
+        """Minutes of departures to request so the window stays covered until the next poll"""
+        return max_minutes + math.ceil(self.max_interval / 60) + 1
+
+    def is_due(self, station_id, params, now, base_interval):
+        """Whether a station has to be fetched in the round starting now
+
+        `params` are the (walk_time, min_minutes, max_minutes, limit) the
+        station is shown with; a change to them makes it due at once.
+        Rounds are base_interval apart, so a fetch due less than half a
+        round from now is made in this one.
+        """
+        entry = self._stations.get(station_id)
+        return entry is None or entry[2] != params or now + base_interval / 2 >= entry[0]
+
+    def interval(self, station_id, base_interval):
+        """Seconds until a station's data is refreshed at the latest"""
+        entry = self._stations.get(station_id)
+        return entry[1] if entry else base_interval
+
+    def schedule(self, station_id, params, state, now, base_interval):
+        """Plan the next fetch of a station after its departures were merged into `state`"""
+        walk_time, min_minutes, max_minutes, limit = params
+        lowest = max(walk_time, min_minutes)
+        next_departure = state.next_departure(now + (lowest - 1) * 60)
+        if next_departure is None:
+            interval = self.idle_interval
+        else:
+            lead = (next_departure - now) / 60 - walk_time
+            interval = 0 if lead <= URGENT_LEAD else lead * 60 / LEAD_SHARE
+
+        # Departures beyond the last one returned are unknown when the
+        # result limit was hit; otherwise up to the requested window.
+        if len(state.trips) >= limit:
+            covered_until = state.last_departure() or now
+        else:
+            covered_until = now + self.window(max_minutes) * 60
+        interval = min(interval, covered_until - now - max_minutes * 60, self.max_interval)
+        interval = max(interval, base_interval)
+
+        with self._lock:
+            self._stations[station_id] = (now + interval, interval, params)
+        return interval
+
+    def forget(self, station_ids):
+        """Drop the schedules of stations not in station_ids"""
+        with self._lock:
+            for station_id in [station_id for station_id in self._stations if station_id not in station_ids]:
+                del self._stations[station_id]
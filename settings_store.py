@@ -0,0 +1,161 @@
+"""Settings kept in memory and saved atomically to a JSON file
+
+Requests only ever read the in-memory dict. Saving writes a temporary
+file, fsyncs it and renames it over the settings file, so a crash or a
+reader in another process never sees half a file. `reload()` picks up
+edits made by other processes or by hand; the poller calls it off the
+request path.
+"""
+import json
+import os
+import threading
+
+from shared_state import ProcessLock, atomic_write
+
+def integer(minimum=None, maximum=None):
+    def validate(value):
+        if isinstance(value, bool) or not isinstance(value, int):
+            raise ValueError(f"expected a whole number, got {value!r}")
+        if minimum is not None and value < minimum or maximum is not None and value > maximum:
+            raise ValueError(f"{value} is not between {minimum} and {maximum}")
+        return value
+    return validate
+
+def number(minimum=None, maximum=None, optional=False):
+    def validate(value):
+        if value is None and optional:
+            return None
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            raise ValueError(f"expected a number, got {value!r}")
+        if minimum is not None and value < minimum or maximum is not None and value > maximum:
+            raise ValueError(f"{value} is not between {minimum} and {maximum}")
+        return float(value)
+    return validate
+
+def boolean(value):
+    if not isinstance(value, bool):
+        raise ValueError(f"expected true or false, got {value!r}")
+    return value
+
+def string(value):
+    if not isinstance(value, str):
+        raise ValueError(f"expected a string, got {value!r}")
+    return value
+
+def choice(*options):
+    def validate(value):
+        if value not in options:
+            raise ValueError(f"expected one of {', '.join(map(str, options))}, got {value!r}")
+        return value
+    return validate
+
+def string_list(value):
+    if not isinstance(value, list) or not all(isinstance(item, str) for item in value):
+        raise ValueError(f"expected a list of strings, got {value!r}")
+    return value
+
+def mapping(value):
+    if not isinstance(value, dict):
+        raise ValueError(f"expected an object, got {value!r}")
+    return value
+
+class SettingsStore(dict):
+    """The settings as a dict, backed by a JSON file
+
+    `schema` maps keys to validators that return the value to store or
+    raise ValueError. Invalid values in the file are replaced by their
+    defaults; invalid changes are rejected.
+    """
+
+    def __init__(self, path, defaults, schema, logger=None):
+        super().__init__(defaults)
+        self.path = path
+        self.defaults = dict(defaults)
+        self.schema = schema
+        self.logger = logger
+        self._lock = threading.RLock()
+        # Serialises saves by all processes sharing the file
+        self._file_lock = ProcessLock(path + '.lock')
+        self._file_state = None
+        self.reload()
+
+    def _warn(self, message, *args):
+        if self.logger is not None:
+            self.logger.warning(message, *args)
+
+    def _stat(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+    def validate(self, key, value):
+        """The value to store for key; raises ValueError if it is invalid"""
+        validator = self.schema.get(key)
+        if validator is None:
+            return value
+        try:
+            return validator(value)
+        except ValueError as e:
+            raise ValueError(f"Invalid setting {key}: {e}") from None
+
+    def _read(self):
+        with open(self.path, 'r') as f:
+            saved = json.load(f)
+        if not isinstance(saved, dict):
+            raise ValueError(f"{self.path} does not hold an object")
+        values = dict(self.defaults)
+        for key, value in saved.items():
+            try:
+                values[key] = self.validate(key, value)
+            except ValueError as e:
+                self._warn("%s, using the default", e)
+        return values
+
+    def reload(self):
+        """Re-read the file if it changed since it was last read or written
+
+        Returns True if the settings were reloaded. An unreadable file
+        keeps the current settings.
+        """
+        with self._lock:
+            state = self._stat()
+            if state == self._file_state:
+                return False
+            self._file_state = state
+            if state is None:
+                return False
+            try:
+                values = self._read()
+            except (OSError, ValueError) as e:
+                self._warn("Could not load %s: %s", self.path, e)
+                return False
+            # Updated in place: every module holds this very dict
+            super().update(values)
+            for key in [key for key in self if key not in values]:
+                del self[key]
+            return True
+
+    def _write(self):
+        with atomic_write(self.path, durable=True) as f:
+            json.dump(dict(self), f, indent=2)
+        self._file_state = self._stat()
+
+    def save(self):
+        """Write the current settings to the file"""
+        with self._lock, self._file_lock:
+            self._write()
+
+    def apply(self, changes):
+        """Validate changes, apply them and save
+
+        The file is re-read first, so changes saved meanwhile by another
+        process are kept. Raises ValueError and changes nothing if any
+        value is invalid.
+        """
+        changes = {key: self.validate(key, value) for key, value in changes.items()}
+        with self._lock, self._file_lock:
+            self.reload()
+            super().update(changes)
+            self._write()
@@ -0,0 +1,186 @@
+"""State shared between the worker processes of one installation
+
+Under gunicorn every worker is its own process with its own module
+globals. Only one of them, the leader, polls the upstream API; it
+publishes the departure board snapshots and its last good departures to
+a SQLite database in WAL mode, from which the other workers read. Every
+worker also publishes its metrics there, so any of them can report the
+totals. The
+leader is whoever holds an flock on a lock file, so when it exits
+another worker takes over.
+"""
+import fcntl
+import json
+import os
+import sqlite3
+import sys
+import threading
+from contextlib import contextmanager
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS snapshots (
+    board TEXT PRIMARY KEY,
+    version INTEGER NOT NULL,
+    updated REAL NOT NULL,
+    body TEXT NOT NULL,
+    etag TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS departures (
+    station_id TEXT PRIMARY KEY,
+    fetched_at REAL NOT NULL,
+    body TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS metrics (
+    pid INTEGER PRIMARY KEY,
+    updated REAL NOT NULL,
+    body TEXT NOT NULL
+);
+"""
+
+@contextmanager
+def atomic_write(path, mode='w', durable=False):
+    """Open a temporary file that replaces path once the block is done
+
+    Readers, in this or another process, see either the old or the new
+    file, never half of one. If the block fails the temporary file is
+    removed and path is left as it was. With `durable` the data is
+    fsynced before the rename and the rename afterwards.
+    """
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, mode) as f:
+            yield f
+            if durable:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+    if durable:
+        try:
+            directory = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+            try:
+                os.fsync(directory)
+            finally:
+                os.close(directory)
+        except OSError:
+            pass  # not supported everywhere; the rename itself is atomic
+
+def little_endian(column):
+    """Byte-swap an array in place on big-endian machines, so files are the same everywhere"""
+    if sys.byteorder == 'big':
+        column.byteswap()
+    return column
+
+class ProcessLock:
+    """Exclusive flock on a file, held across threads of one process
+
+    Usable as a blocking context manager, or with acquire(blocking=False)
+    to hold it for as long as the process lives.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+        self._threads = threading.Lock()
+
+    def acquire(self, blocking=True):
+        if not self._threads.acquire(blocking):
+            return False
+        try:
+            self._file = open(self.path, 'a')
+            fcntl.flock(self._file, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except OSError:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            self._threads.release()
+            return False
+
+    def release(self):
+        fcntl.flock(self._file, fcntl.LOCK_UN)
+        self._file.close()
+        self._file = None
+        self._threads.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+class SnapshotStore:
+    """Board snapshots, last good departures and metrics in a SQLite WAL database"""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        with self._connect() as db:
+            db.executescript(SCHEMA)
+
+    def _connect(self):
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=5)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            self._local.db = db
+        return db
+
+    def publish(self, version, updated, snapshots):
+        """Replace all snapshots; `snapshots` maps board name to (body, etag)"""
+        with self._connect() as db:
+            db.execute('DELETE FROM snapshots')
+            db.executemany(
+                'INSERT INTO snapshots (board, version, updated, body, etag) VALUES (?, ?, ?, ?, ?)',
+                [(board or '', version, updated, body, etag) for board, (body, etag) in snapshots.items()]
+            )
+
+    def version(self):
+        """Version of the published snapshots, None if there are none"""
+        return self._connect().execute('SELECT MAX(version) FROM snapshots').fetchone()[0]
+
+    def load(self):
+        """(version, updated, {board: (body, etag)}) of the published snapshots, None if there are none"""
+        rows = self._connect().execute('SELECT board, version, updated, body, etag FROM snapshots').fetchall()
+        if not rows:
+            return None
+        return rows[0][1], rows[0][2], {board or None: (body, etag) for board, _, _, body, etag in rows}
+
+    def save_departures(self, entries):
+        """Store last good departures; `entries` maps station ID to (departures, fetched_at)"""
+        with self._connect() as db:
+            db.executemany(
+                'INSERT OR REPLACE INTO departures (station_id, fetched_at, body) VALUES (?, ?, ?)',
+                [(station_id, fetched_at, json.dumps(departures))
+                 for station_id, (departures, fetched_at) in entries.items()]
+            )
+
+    def load_departures(self, max_age, now):
+        """Last good departures not older than max_age seconds, as save_departures takes them"""
+        rows = self._connect().execute(
+            'SELECT station_id, fetched_at, body FROM departures WHERE fetched_at >= ?', (now - max_age,)
+        ).fetchall()
+        return {station_id: (json.loads(body), fetched_at) for station_id, fetched_at, body in rows}
+
+    def save_metrics(self, pid, updated, state):
+        """Publish the metrics state of the process pid"""
+        with self._connect() as db:
+            db.execute('INSERT OR REPLACE INTO metrics (pid, updated, body) VALUES (?, ?, ?)',
+                       (pid, updated, json.dumps(state)))
+
+    def load_metrics(self, since, exclude=None):
+        """Metrics states published since the timestamp `since`, except that of pid `exclude`
+
+        States of processes that stopped publishing before `since` are deleted.
+        """
+        with self._connect() as db:
+            db.execute('DELETE FROM metrics WHERE updated < ?', (since,))
+            rows = db.execute('SELECT pid, body FROM metrics').fetchall()
+        return [json.loads(body) for pid, body in rows if pid != exclude]
@@ -0,0 +1,160 @@
+// Per-page values are rendered into the board-config element
+const config = JSON.parse(document.getElementById('board-config').textContent);
+const pollInterval = config.pollInterval;
+const streamUrl = config.streamUrl;
+const showPlatform = config.showPlatform;
+const i18n = config.i18n;
+let countdown = pollInterval;
+const countdownElement = document.getElementById('countdown');
+let activeFilters = new Set(['s', 'u', 'tram', 'bus', 'regional']);
+
+function updateCountdown() {
+    countdown--;
+    countdownElement.textContent = countdown;
+
+    if (countdown <= 0) {
+        countdownElement.textContent = i18n.updating;
+    }
+}
+
+function el(tag, className, text) {
+    const node = document.createElement(tag);
+    if (className) node.className = className;
+    if (text !== undefined) node.textContent = text;
+    return node;
+}
+
+function renderRow(dep) {
+    const row = el('tr', 'transport-' + dep.line_type);
+    row.dataset.id = dep.id;
+
+    const station = el('td');
+    station.appendChild(el('span', 'station-name', dep.station_name));
+    if (dep.age) {
+        station.appendChild(document.createTextNode(' '));
+        station.appendChild(el('span', 'data-age', i18n.data_age.replace('%s', dep.age)));
+    }
+    row.appendChild(station);
+    row.appendChild(el('td', '', dep.direction));
+
+    const line = el('td');
+    line.appendChild(el('span', 'line-number line-' + dep.line_type, dep.line));
+    row.appendChild(line);
+
+    const times = el('td');
+    const first = el('div', '', dep.minutes + ' ' + i18n.min);
+    if (dep.delay) {
+        first.appendChild(document.createTextNode(' '));
+        first.appendChild(el('span', 'delay-info', '(+' + dep.delay + i18n.min + ')'));
+    }
+    times.appendChild(first);
+    if (dep.next_times.length) {
+        times.appendChild(el('div', 'next-times', dep.next_times.map(m => m + i18n.min).join(', ')));
+    }
+    row.appendChild(times);
+
+    if (showPlatform) row.appendChild(el('td', '', dep.platform));
+
+    const leave = el('td', 'urgency-' + dep.urgency + (dep.delay ? ' delayed' : ''));
+    if (dep.urgency === 'now') leave.appendChild(el('span', 'blink-red'));
+    else if (dep.urgency === 'soon') leave.appendChild(el('span', 'blink-orange'));
+    leave.appendChild(document.createTextNode(dep.leave_in_minutes > 0 ? dep.leave_in_minutes + ' ' + i18n.min : i18n.now));
+    row.appendChild(leave);
+    return row;
+}
+
+function patchDepartures(update) {
+    const table = document.getElementById('departures');
+    const rows = {};
+    table.querySelectorAll('tr[data-id]').forEach(row => { rows[row.dataset.id] = row; });
+
+    if (update.reset) {
+        Object.values(rows).forEach(row => row.remove());
+        Object.keys(rows).forEach(id => delete rows[id]);
+    }
+    (update.remove || []).forEach(id => {
+        if (rows[id]) {
+            rows[id].remove();
+            delete rows[id];
+        }
+    });
+    (update.upsert || []).forEach(dep => {
+        const row = renderRow(dep);
+        if (rows[dep.id]) rows[dep.id].replaceWith(row);
+        else table.appendChild(row);
+        rows[dep.id] = row;
+    });
+    // appendChild moves existing rows, so this applies the new order in place
+    (update.order || []).forEach(id => { if (rows[id]) table.appendChild(rows[id]); });
+
+    const empty = table.querySelectorAll('tr[data-id]').length === 0;
+    table.style.display = empty ? 'none' : '';
+    document.getElementById('no-departures').style.display = empty ? '' : 'none';
+    applyFilters();
+    countdown = pollInterval;
+    countdownElement.textContent = countdown;
+}
+
+function connectStream() {
+    if (!window.EventSource) {
+        // No streaming support: fall back to reloading the whole page
+        setTimeout(() => location.reload(), pollInterval * 1000);
+        return;
+    }
+    const source = new EventSource(streamUrl);
+    source.addEventListener('departures', event => patchDepartures(JSON.parse(event.data)));
+    source.addEventListener('error', () => {
+        // Refused (e.g. the server has too many open streams): EventSource
+        // does not retry, so reload the page later like without streaming
+        if (source.readyState === EventSource.CLOSED) {
+            setTimeout(() => location.reload(), pollInterval * 1000);
+        }
+    });
+}
+
+function toggleTheme() {
+    const body = document.body;
+    const currentTheme = body.getAttribute('data-theme');
+    const newTheme = currentTheme === 'dark' ? 'light' : 'dark';
+    body.setAttribute('data-theme', newTheme);
+    localStorage.setItem('theme', newTheme);
+}
+
+function toggleFilter(type) {
+    const btn = document.querySelector(`[data-type="${type}"]`);
+    if (activeFilters.has(type)) {
+        activeFilters.delete(type);
+        btn.classList.remove('active');
+    } else {
+        activeFilters.add(type);
+        btn.classList.add('active');
+    }
+    localStorage.setItem('activeFilters', JSON.stringify([...activeFilters]));
+    applyFilters();
+}
+
+function applyFilters() {
+    document.querySelectorAll('tr[class*="transport-"]').forEach(row => {
+        const transportType = [...row.classList].find(c => c.startsWith('transport-')).replace('transport-', '');
+        const typeVisible = activeFilters.has(transportType);
+        row.style.display = typeVisible ? '' : 'none';
+    });
+}
+
+document.addEventListener('DOMContentLoaded', function() {
+    // Load theme
+    const savedTheme = localStorage.getItem('theme') || 'dark';
+    document.body.setAttribute('data-theme', savedTheme);
+
+    // Load filters
+    const savedFilters = JSON.parse(localStorage.getItem('activeFilters') || '["s","u","tram","bus","regional"]');
+    activeFilters = new Set(savedFilters);
+    document.querySelectorAll('[data-type]').forEach(btn => {
+        btn.classList.toggle('active', activeFilters.has(btn.dataset.type));
+    });
+
+    applyFilters();
+    connectStream();
+});
+
+setInterval(updateCountdown, 1000);
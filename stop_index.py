@@ -0,0 +1,170 @@
+"""Nearby-stop search over a local copy of the VBB stops
+
+Loads the stations from a GTFS stops.txt (the VBB feed at
+https://www.vbb.de/vbb-services/api-open-data/datensaetze/) into flat
+arrays, ordered by grid cell so each cell is one contiguous slice. A
+query only looks at the cells around the location and filters them
+with a haversine distance, vectorised with NumPy when it is installed
+(imported when the first index is built, not with this module).
+
+    python stop_index.py stops.txt 52.5219 13.4132 [radius]
+"""
+import csv
+import math
+import re
+import sys
+from array import array
+
+numpy = None
+
+def _import_numpy():
+    """NumPy if it is installed, None otherwise"""
+    global numpy
+    if numpy is None:
+        try:
+            import numpy
+        except ImportError:
+            return None
+    return numpy
+
+EARTH_RADIUS = 6371000  # meters
+METERS_PER_DEGREE = 111320
+CELL_SIZE = 0.01  # degrees, about 1.1 km north-south and 0.7 km east-west in Berlin
+
+def stop_id_from_gtfs(gtfs_id):
+    """The id transport.rest uses for a GTFS stop id
+
+    'de:11000:900100003' (IFOPT) and '900000100003' (old HAFAS) both
+    become '900100003'.
+    """
+    parts = gtfs_id.split(':')
+    if len(parts) >= 3:
+        return parts[2]
+    match = re.fullmatch(r'900000(\d{6})', gtfs_id)
+    return f"900{match.group(1)}" if match else gtfs_id
+
+def read_gtfs_stations(path):
+    """Yield (id, name, lat, lon) for every station in a GTFS stops.txt
+
+    Platforms and entrances belonging to a parent station are skipped.
+    """
+    seen = set()
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        for record in csv.DictReader(f):
+            location_type = record.get('location_type') or '0'
+            if location_type not in ('0', '1'):
+                continue
+            if location_type == '0' and record.get('parent_station'):
+                continue
+            stop_id = stop_id_from_gtfs(record['stop_id'])
+            if stop_id in seen:
+                continue
+            try:
+                lat, lon = float(record['stop_lat']), float(record['stop_lon'])
+            except (KeyError, ValueError):
+                continue
+            seen.add(stop_id)
+            yield stop_id, record.get('stop_name', ''), lat, lon
+
+def grid_cell(lat, lon):
+    """(row, column) of the grid cell holding a location"""
+    return math.floor(lat / CELL_SIZE), math.floor(lon / CELL_SIZE)
+
+class StopIndex:
+    """Stations in flat arrays with a grid over them"""
+
+    def __init__(self, stations):
+        stations = sorted(stations, key=lambda station: grid_cell(station[2], station[3]))
+        self.ids = [station[0] for station in stations]
+        self.names = [station[1] for station in stations]
+        self.lats = array('d', (station[2] for station in stations))
+        self.lons = array('d', (station[3] for station in stations))
+
+        # cell -> (start, end) slice of the arrays above
+        self.cells = {}
+        for i, station in enumerate(stations):
+            cell = grid_cell(station[2], station[3])
+            start, _ = self.cells.get(cell, (i, i))
+            self.cells[cell] = (start, i + 1)
+
+        if _import_numpy() is not None:
+            self._lats_rad = numpy.radians(numpy.frombuffer(self.lats, dtype=numpy.float64))
+            self._lons_rad = numpy.radians(numpy.frombuffer(self.lons, dtype=numpy.float64))
+
+    @classmethod
+    def from_gtfs(cls, path):
+        return cls(read_gtfs_stations(path))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _candidate_slices(self, lat, lon, radius):
+        lat_span = radius / METERS_PER_DEGREE
+        lon_span = radius / (METERS_PER_DEGREE * max(math.cos(math.radians(lat)), 0.01))
+        min_row, min_col = grid_cell(lat - lat_span, lon - lon_span)
+        max_row, max_col = grid_cell(lat + lat_span, lon + lon_span)
+        for row in range(min_row, max_row + 1):
+            for col in range(min_col, max_col + 1):
+                bounds = self.cells.get((row, col))
+                if bounds:
+                    yield bounds
+
+    def _distances_numpy(self, lat, lon, slices):
+        indices = numpy.concatenate([numpy.arange(start, end) for start, end in slices])
+        lat1, lon1 = math.radians(lat), math.radians(lon)
+        lat2, lon2 = self._lats_rad[indices], self._lons_rad[indices]
+        a = (numpy.sin((lat2 - lat1) / 2) ** 2 +
+             math.cos(lat1) * numpy.cos(lat2) * numpy.sin((lon2 - lon1) / 2) ** 2)
+        distances = 2 * EARTH_RADIUS * numpy.arcsin(numpy.sqrt(a))
+        return zip(indices.tolist(), distances.tolist())
+
+    def _distances_python(self, lat, lon, slices):
+        lat1, lon1 = math.radians(lat), math.radians(lon)
+        cos_lat1 = math.cos(lat1)
+        lats, lons = self.lats, self.lons
+        for start, end in slices:
+            for i in range(start, end):
+                lat2, lon2 = math.radians(lats[i]), math.radians(lons[i])
+                a = (math.sin((lat2 - lat1) / 2) ** 2 +
+                     cos_lat1 * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2)
+                yield i, 2 * EARTH_RADIUS * math.asin(math.sqrt(a))
+
+    def nearby(self, lat, lon, radius=1000, limit=None):
+        """Stations within radius meters, nearest first
+
+        Returns dicts shaped like transport.rest's /locations/nearby results.
+        """
+        slices = list(self._candidate_slices(lat, lon, radius))
+        if not slices:
+            return []
+        distances = self._distances_numpy if numpy is not None else self._distances_python
+        found = sorted((distance, i) for i, distance in distances(lat, lon, slices) if distance <= radius)
+        if limit is not None:
+            found = found[:limit]
+        return [self.station(i, distance) for distance, i in found]
+
+    def station(self, i, distance=None):
+        stop_id = self.ids[i]
+        station = {
+            'type': 'stop',
+            'id': stop_id,
+            'name': self.names[i],
+            'location': {
+                'type': 'location',
+                'id': stop_id,
+                'latitude': self.lats[i],
+                'longitude': self.lons[i]
+            }
+        }
+        if distance is not None:
+            station['distance'] = int(round(distance))
+        return station
+
+if __name__ == '__main__':
+    if len(sys.argv) not in (4, 5):
+        print(__doc__)
+        sys.exit(1)
+    index = StopIndex.from_gtfs(sys.argv[1])
+    radius = int(sys.argv[4]) if len(sys.argv) == 5 else 1000
+    for station in index.nearby(float(sys.argv[2]), float(sys.argv[3]), radius):
+        print(f"{station['distance']:>6} m  {station['id']}  {station['name']}")
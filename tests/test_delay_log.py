@@ -0,0 +1,10 @@
+from delay_log import percentile
+
+def test_percentile_nearest_rank():
+    assert percentile([1, 2, 3, 4, 5], 50) == 3
+    assert percentile([1, 2, 3, 4], 50) == 2
+    assert percentile(list(range(1, 10)), 50) == 5
+    values = list(range(1, 21))
+    assert percentile(values, 90) == 18
+    assert percentile(values, 95) == 19
+    assert percentile([7], 95) == 7
@@ -0,0 +1,294 @@
+"""Walking times from a home location to stations
+
+Without more data a walk is the straight-line distance with a detour
+factor, at 80 m per minute. With a footway graph built from an
+OpenStreetMap extract, walks follow the actual paths instead:
+
+    python walking.py build berlin.osm footways.graph
+
+One Dijkstra search from the home's nearest graph node answers all
+stations around it. Its results are memoised per (home, station) and
+kept on disk, so they are computed once per location, not per request.
+"""
+import heapq
+import json
+import math
+import os
+import struct
+import sys
+import threading
+from array import array
+
+from shared_state import atomic_write, little_endian
+from stop_index import EARTH_RADIUS, grid_cell
+
+WALKING_SPEED = 80  # meters per minute
+DETOUR_FACTOR = 1.3  # walked distance per straight-line distance
+SNAP_DISTANCE = 250  # meters from a location to the graph before it counts as off the graph
+MAX_ROUTE = 5000  # meters searched from a home
+
+MAGIC = b'FWG1'
+HEADER = struct.Struct('<4sIII')
+
+# Roads and paths open to pedestrians; motorways and trunk roads are not
+WALKABLE = {
+    'footway', 'path', 'pedestrian', 'living_street', 'residential', 'service', 'steps',
+    'track', 'unclassified', 'tertiary', 'tertiary_link', 'secondary', 'secondary_link',
+    'primary', 'primary_link', 'cycleway', 'corridor', 'platform', 'bridleway', 'road',
+}
+
+def calculate_distance(lat1, lon1, lat2, lon2):
+    """Calculate distance between two coordinates in meters"""
+    lat1_rad = math.radians(lat1)
+    lat2_rad = math.radians(lat2)
+    delta_lat = math.radians(lat2 - lat1)
+    delta_lon = math.radians(lon2 - lon1)
+    a = (math.sin(delta_lat / 2) ** 2 +
+         math.cos(lat1_rad) * math.cos(lat2_rad) * math.sin(delta_lon / 2) ** 2)
+    return EARTH_RADIUS * 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+
+def straight_walk_time(distance):
+    """Minutes to walk a straight-line distance in meters"""
+    return int(distance * DETOUR_FACTOR / WALKING_SPEED)
+
+def straight_walk_times(lat, lon, stations):
+    """Straight-line walking minutes from (lat, lon) to (id, lat, lon) stations, as a dict by id"""
+    return {station_id: straight_walk_time(calculate_distance(lat, lon, station_lat, station_lon))
+            for station_id, station_lat, station_lon in stations}
+
+class FootwayGraph:
+    """Walkable OSM ways as an adjacency array, nodes ordered by grid cell"""
+
+    def __init__(self, lats, lons, offsets, targets, lengths):
+        self.lats = lats
+        self.lons = lons
+        self.offsets = offsets  # edges of node i are targets[offsets[i]:offsets[i + 1]]
+        self.targets = targets
+        self.lengths = lengths  # meters
+        # cell -> (start, end) slice of the node arrays
+        self.cells = {}
+        previous = None
+        for i in range(len(lats)):
+            cell = grid_cell(lats[i], lons[i])
+            if cell != previous:
+                self.cells[cell] = (i, i + 1)
+                previous = cell
+            else:
+                self.cells[cell] = (self.cells[cell][0], i + 1)
+
+    def __len__(self):
+        return len(self.lats)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            magic, nodes, edges, _ = HEADER.unpack(f.read(HEADER.size))
+            if magic != MAGIC:
+                raise ValueError(f"{path} is not a footway graph")
+            columns = []
+            for typecode, count in (('d', nodes), ('d', nodes), ('I', nodes + 1), ('I', edges), ('f', edges)):
+                column = array(typecode)
+                column.fromfile(f, count)
+                columns.append(little_endian(column))
+        return cls(*columns)
+
+    def save(self, path):
+        with atomic_write(path, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, len(self.lats), len(self.targets), 0))
+            for column in (self.lats, self.lons, self.offsets, self.targets, self.lengths):
+                little_endian(array(column.typecode, column)).tofile(f)
+
+    def nearest_node(self, lat, lon):
+        """(node, distance in meters) of the node closest to a location, None if none is near"""
+        best = None
+        row, col = grid_cell(lat, lon)
+        for cell_row in (row - 1, row, row + 1):
+            for cell_col in (col - 1, col, col + 1):
+                start, end = self.cells.get((cell_row, cell_col), (0, 0))
+                for i in range(start, end):
+                    distance = calculate_distance(lat, lon, self.lats[i], self.lons[i])
+                    if best is None or distance < best[1]:
+                        best = (i, distance)
+        if best is None or best[1] > SNAP_DISTANCE:
+            return None
+        return best
+
+    def shortest_paths(self, source, targets, cutoff=MAX_ROUTE):
+        """Meters along the graph from source to each reachable node in targets"""
+        remaining = set(targets)
+        found = {}
+        settled = {}
+        queue = [(0.0, source)]
+        while queue and remaining:
+            distance, node = heapq.heappop(queue)
+            if node in settled:
+                continue
+            settled[node] = distance
+            if node in remaining:
+                remaining.discard(node)
+                found[node] = distance
+            for edge in range(self.offsets[node], self.offsets[node + 1]):
+                target = self.targets[edge]
+                if target not in settled:
+                    next_distance = distance + self.lengths[edge]
+                    if next_distance <= cutoff:
+                        heapq.heappush(queue, (next_distance, target))
+        return found
+
+def read_osm_ways(osm_path):
+    """(node id -> (lat, lon), walkable ways as node id lists) from an OSM XML extract"""
+    import xml.etree.ElementTree as ElementTree
+
+    ways = []
+    wanted = set()
+    for _, element in ElementTree.iterparse(osm_path):
+        if element.tag == 'way':
+            tags = {tag.get('k'): tag.get('v') for tag in element.iter('tag')}
+            walkable = tags.get('highway') in WALKABLE or tags.get('foot') in ('yes', 'designated')
+            if walkable and tags.get('foot') not in ('no', 'private') and tags.get('access') != 'private':
+                refs = [int(nd.get('ref')) for nd in element.iter('nd')]
+                ways.append(refs)
+                wanted.update(refs)
+        if element.tag in ('node', 'way', 'relation'):
+            element.clear()
+    # Nodes come before ways in an extract, so they are read in a second pass
+    coordinates = {}
+    for _, element in ElementTree.iterparse(osm_path):
+        if element.tag == 'node':
+            node_id = int(element.get('id'))
+            if node_id in wanted:
+                coordinates[node_id] = (float(element.get('lat')), float(element.get('lon')))
+            element.clear()
+    return coordinates, ways
+
+def build_graph(osm_path, graph_path):
+    """Build the footway graph from an OSM XML extract; returns it"""
+    coordinates, ways = read_osm_ways(osm_path)
+    node_ids = sorted(coordinates, key=lambda node_id: grid_cell(*coordinates[node_id]))
+    index = {node_id: i for i, node_id in enumerate(node_ids)}
+    adjacency = [[] for _ in node_ids]
+    for refs in ways:
+        for a, b in zip(refs, refs[1:]):
+            if a in index and b in index:
+                length = calculate_distance(*coordinates[a], *coordinates[b])
+                adjacency[index[a]].append((index[b], length))
+                adjacency[index[b]].append((index[a], length))
+    offsets = array('I', [0])
+    targets = array('I')
+    lengths = array('f')
+    for edges in adjacency:
+        for target, length in edges:
+            targets.append(target)
+            lengths.append(length)
+        offsets.append(len(targets))
+    graph = FootwayGraph(array('d', (coordinates[node_id][0] for node_id in node_ids)),
+                         array('d', (coordinates[node_id][1] for node_id in node_ids)),
+                         offsets, targets, lengths)
+    graph.save(graph_path)
+    return graph
+
+class WalkingModel:
+    """Walking minutes from homes to stations, memoised per pair
+
+    Uses the footway graph when there is one and falls back to the
+    straight-line estimate for places it does not cover. Times from the
+    graph are kept in `cache_path` for as long as the graph file is
+    unchanged, and the graph itself is only loaded once a time is missing.
+    If it cannot be loaded the model sticks to straight-line estimates.
+    """
+
+    def __init__(self, graph_path=None, graph_signature=None, cache_path=None, logger=None):
+        self.graph_path = graph_path
+        self.graph_signature = graph_signature
+        self.cache_path = cache_path
+        self.logger = logger
+        self._graph = None
+        self._lock = threading.Lock()
+        self._homes = {}
+        if graph_path is not None and cache_path and os.path.exists(cache_path):
+            try:
+                with open(cache_path, 'r') as f:
+                    saved = json.load(f)
+                if isinstance(saved, dict) and saved.get('graph') == graph_signature:
+                    self._homes = saved.get('homes', {})
+            except Exception:
+                pass
+
+    @classmethod
+    def open(cls, graph_path, cache_path=None, logger=None):
+        """Model with the graph at graph_path, straight-line only if there is none"""
+        try:
+            stat = os.stat(graph_path) if graph_path else None
+        except OSError:
+            stat = None
+        if stat is None:
+            return cls(logger=logger)
+        return cls(graph_path, f"{stat.st_size}:{stat.st_mtime_ns}", cache_path, logger)
+
+    @property
+    def graph(self):
+        """The footway graph, loaded on first use; None without a usable one"""
+        if self._graph is None and self.graph_path is not None:
+            try:
+                self._graph = FootwayGraph.load(self.graph_path)
+            except Exception as e:
+                if self.logger is not None:
+                    self.logger.warning("Could not load footway graph %s: %s, using straight-line walking times",
+                                        self.graph_path, e)
+                # Not retried on every call; the model is straight-line only from now on
+                self.graph_path = None
+        return self._graph
+
+    def _save(self):
+        try:
+            with atomic_write(self.cache_path) as f:
+                json.dump({'graph': self.graph_signature, 'homes': self._homes}, f)
+        except Exception:
+            pass
+
+    def _route_times(self, graph, lat, lon, stations):
+        """Walking minutes along the graph to (id, lat, lon) stations it reaches"""
+        home = graph.nearest_node(lat, lon)
+        if home is None:
+            return {}
+        snapped = {}
+        for station_id, station_lat, station_lon in stations:
+            node = graph.nearest_node(station_lat, station_lon)
+            if node is not None:
+                snapped[station_id] = node
+        routes = graph.shortest_paths(home[0], {node for node, _ in snapped.values()})
+        times = {}
+        for station_id, (node, snap) in snapped.items():
+            if node in routes:
+                # Getting onto and off the graph counts as a straight-line walk
+                meters = routes[node] + (home[1] + snap) * DETOUR_FACTOR
+                times[station_id] = int(meters / WALKING_SPEED)
+        return times
+
+    def walk_times(self, lat, lon, stations):
+        """Walking minutes from (lat, lon) to (id, lat, lon) stations, as a dict by id"""
+        if self.graph_path is None:
+            return straight_walk_times(lat, lon, stations)
+        key = f"{lat:.5f},{lon:.5f}"
+        with self._lock:
+            known = self._homes.get(key, {})
+            missing = [station for station in stations if station[0] not in known]
+            if missing:
+                graph = self.graph
+                if graph is None:
+                    return straight_walk_times(lat, lon, stations)
+                known = self._homes.setdefault(key, known)
+                routes = self._route_times(graph, lat, lon, missing)
+                for station_id, station_lat, station_lon in missing:
+                    known[station_id] = routes.get(station_id, straight_walk_time(
+                        calculate_distance(lat, lon, station_lat, station_lon)))
+                if self.cache_path:
+                    self._save()
+            return {station[0]: known[station[0]] for station in stations}
+
+if __name__ == '__main__':
+    if len(sys.argv) != 4 or sys.argv[1] != 'build':
+        print(__doc__)
+        sys.exit(1)
+    graph = build_graph(sys.argv[2], sys.argv[3])
+    print(f"Wrote {len(graph)} nodes and {len(graph.targets) // 2} footway segments to {sys.argv[3]}")
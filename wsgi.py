@@ -0,0 +1,11 @@
+"""WSGI entry point for production servers
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+Every worker process imports this module after the fork and starts its
+poller thread; one of them becomes the leader and fetches departures for
+all of them (see shared_state.py).
+"""
+from nearby_departures import app, poller
+
+poller.start()